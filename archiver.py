@@ -0,0 +1,76 @@
+import os
+from typing import List, Set
+from datetime import datetime
+
+from consts import *
+from json_util import save_json
+from local_db import update_db, save_local_db, append_db_journal, is_db_journal_oversized
+from similarity import update_similarity_index
+from thumb_hash import is_hashing_available, update_thumb_hash_index
+from util import datetime_to_timestring, datetime_to_timestamp
+from yt_api import list_account_playlists, read_list_of_playlists_file, dump_playlist_meta, dump_playlists
+
+
+def run_dump(youtube_api, db: object, root_dir: str, set_names: List[str], no_thumbs: bool, no_backup: bool, thumb_list: Set[str] = None, journal: bool = False) -> List[str]:
+	"""
+	Dumps selected playlist sets in a single pass, saves a dump file for each set, then updates the database and
+	saves it once. Database is not saved if nothing has changed, not even a snapshot timestamp.
+
+	@db: database object, it will be updated in place
+	@set_names: names of playlist sets to dump (DUMP_SET_ACCOUNT and/or DUMP_SET_SAVED)
+	@thumb_list: set of video ids that have a thumbnail downloaded, see dump_playlists()
+	@journal: instead of rewriting the whole database, only append changed entries and snapshot timestamp bumps to
+		database journal (see append_db_journal()). The whole database is saved only when the journal grows too big.
+
+	@returns: list of paths of saved dump files, or None if dump was aborted
+	"""
+	db_path = os.path.join(root_dir, FILENAME_DB)
+	backups_dir_path = os.path.join(root_dir, DIR_BACKUPS)
+	thumbs_dir_path = os.path.join(root_dir, DIR_THUMBS)
+	dumps_dir_path = os.path.join(root_dir, DIR_DUMPS)
+	saved_playlists_path = os.path.join(root_dir, FILENAME_SAVED_PLAYLISTS)
+
+	time_now = datetime.now()
+
+	# gather playlists of all selected sets first, so that each playlist is fetched only once
+	playlist_sets = {}
+
+	if DUMP_SET_ACCOUNT in set_names:
+		playlist_sets[DUMP_SET_ACCOUNT] = list_account_playlists(youtube_api)
+
+	if DUMP_SET_SAVED in set_names:
+		playlist_ids = read_list_of_playlists_file(saved_playlists_path)
+		if playlist_ids is None:
+			return None
+		playlist_sets[DUMP_SET_SAVED] = dump_playlist_meta(youtube_api, playlist_ids)
+
+	full_dump, dumps_refs = dump_playlists(youtube_api, thumbs_dir_path, no_thumbs, time_now, playlist_sets, thumb_list)
+
+	os.makedirs(dumps_dir_path, exist_ok=True)
+	dump_paths = []
+	for set_name, refs_dump in dumps_refs.items():
+		dump_path = os.path.join(dumps_dir_path, "dump_%s_%s.json" % (datetime_to_timestring(time_now), set_name))
+		save_json(refs_dump, dump_path)
+		dump_paths.append(dump_path)
+
+	changed_ids = set()
+	bumped = {}
+	update_db(db, full_dump, datetime_to_timestamp(time_now), changed_ids, bumped)
+
+	if len(changed_ids) == 0 and len(bumped) == 0:
+		print("Database unchanged")
+	elif journal:
+		print("Appending", len(changed_ids), "changed entries and", len(bumped), "timestamp updates to database journal")
+		append_db_journal(db, db_path, changed_ids, bumped)
+		if is_db_journal_oversized(db_path):
+			print("Compacting database journal")
+			save_local_db(db, db_path, backups_dir_path, no_backup, time_now)
+	else:
+		save_local_db(db, db_path, backups_dir_path, no_backup, time_now)
+
+	update_similarity_index(db, root_dir, changed_ids)
+
+	if not no_thumbs and is_hashing_available():
+		update_thumb_hash_index(root_dir)
+
+	return dump_paths
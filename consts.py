@@ -1,13 +1,24 @@
 DEFAULT_ROOT = "yt_meta_dump"
 FILENAME_DB = "db.json"
 FILENAME_SAVED_PLAYLISTS = "saved_playlists.txt"
+FILENAME_CREDENTIALS = "credentials.json"
+FILENAME_DISCOVERY = "discovery_youtube_v3.json"
+FILENAME_CONTROL_SOCKET = "daemon.sock"
+FILENAME_EXPORT_STATE = "export_state.sqlite"
+FILENAME_THUMB_HASHES = "thumb_hashes.json"
+FILENAME_SIMILARITY_INDEX = "similarity_index.json"
+JOURNAL_SUFFIX = ".journal"
 DIR_BACKUPS = "backups"
 DIR_DUMPS = "dumps"
 DIR_HTML = "html"
 DIR_THUMBS = "thumbs"
+DIR_QUARANTINE = "quarantine"
 
 DB_TEMPLATE = {}
 
+DUMP_SET_ACCOUNT = "account"
+DUMP_SET_SAVED = "saved"
+
 JSON_KEY_PLAYLISTS = "playlists"
 JSON_KEY_TITLE = "title"
 JSON_KEY_VIDEOS = "videos"
@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import random
+import signal
+import socket
+import selectors
+import threading
+from datetime import datetime
+from typing import Dict, List
+
+from consts import *
+from archiver import run_dump
+from html_gen import generate_html, timestamp_to_datestring
+from json_util import load_json
+from local_db import get_local_db, get_db_journal_path, save_local_db
+from util import get_file_title_from_path, get_thumb_list
+from yt_api import build_yt_api_object
+
+CONTROL_CMD_RUN = "run"
+CONTROL_CMD_STATUS = "status"
+CONTROL_MAX_MSG_LEN = 1024
+CONTROL_TIMEOUT = 5 # seconds
+CONTROL_POLL_INTERVAL = 1 # seconds, how often control thread checks if the daemon is stopping
+
+
+class Daemon:
+	"""
+	Stays resident and dumps playlist sets on a schedule. Database and thumbnail index are loaded once and kept in
+	memory between runs. After each run only changed database entries are appended to database journal, the whole
+	database is saved (compacting the journal) only when the journal grows too big, and on exit.
+
+	Runs can be triggered immediately and status can be queried via a local control socket (see send_control_command())
+	or via signals: SIGUSR1 triggers a run of all sets, SIGUSR2 prints status. The control socket is served from its
+	own thread, so that it responds while a dump is running.
+	"""
+
+	def __init__(self, root_dir: str, intervals: Dict[str, int], jitter: int, no_thumbs: bool, no_backup: bool, gen_html: bool):
+		"""
+		@intervals: dictionary mapping set name to interval between runs, in seconds
+		@jitter: maximum random delay added to each interval, in seconds
+		"""
+		self.root_dir = root_dir
+		self.intervals = intervals
+		self.jitter = jitter
+		self.no_thumbs = no_thumbs
+		self.no_backup = no_backup
+		self.gen_html = gen_html
+
+		self.db_path = os.path.join(root_dir, FILENAME_DB)
+		self.backups_dir_path = os.path.join(root_dir, DIR_BACKUPS)
+		self.thumbs_dir_path = os.path.join(root_dir, DIR_THUMBS)
+		self.html_dir_path = os.path.join(root_dir, DIR_HTML)
+		self.control_socket_path = os.path.join(root_dir, FILENAME_CONTROL_SOCKET)
+
+		os.makedirs(self.thumbs_dir_path, exist_ok=True)
+
+		self.youtube_api = build_yt_api_object(root_dir)
+		self.db = get_local_db(self.db_path)
+		self.thumb_list = get_thumb_list(self.thumbs_dir_path)
+
+		# run all sets right after start
+		self.next_run = { set_name: time.time() for set_name in intervals }
+
+		self.start_time = time.time()
+		self.run_count = 0
+		self.last_run_time = None
+		self.last_run_sets = None
+		self.last_run_result = None
+		self.running_sets = None
+		# guards run bookkeeping above, which is read by control thread
+		self.lock = threading.Lock()
+
+		self.stop_requested = False
+		self.status_requested = False
+
+		self.selector = selectors.DefaultSelector()
+		self.server_sock = None
+		self.control_thread = None
+		self.wakeup_rsock = None
+		self.wakeup_wsock = None
+
+	def schedule_next_run(self, set_name: str):
+		self.next_run[set_name] = time.time() + self.intervals[set_name] + random.uniform(0, self.jitter)
+
+	def get_status(self) -> object:
+		with self.lock:
+			return {
+				"started": timestamp_to_datestring(self.start_time),
+				"runs": self.run_count,
+				"running": self.running_sets,
+				"lastRun": timestamp_to_datestring(self.last_run_time) if self.last_run_time is not None else None,
+				"lastRunSets": self.last_run_sets,
+				"lastRunResult": self.last_run_result,
+				"nextRun": { set_name: timestamp_to_datestring(t) for set_name, t in self.next_run.items() },
+				"videos": len(self.db),
+				"thumbnails": len(self.thumb_list),
+			}
+
+	def set_run_result(self, result: str):
+		with self.lock:
+			self.last_run_result = result
+			self.running_sets = None
+
+	def run(self, set_names: List[str]):
+		print("Running scheduled dump of:", ", ".join(set_names))
+
+		with self.lock:
+			self.last_run_time = time.time()
+			self.last_run_sets = set_names
+			self.running_sets = set_names
+			self.run_count += 1
+
+			for set_name in set_names:
+				self.schedule_next_run(set_name)
+
+		try:
+			dump_paths = run_dump(self.youtube_api, self.db, self.root_dir, set_names, self.no_thumbs, self.no_backup, self.thumb_list, journal=True)
+		except Exception as ex:
+			# stay resident, next scheduled run might succeed
+			print("Dump failed:", ex)
+			self.set_run_result("error: %s" % ex)
+			return
+
+		if dump_paths is None:
+			print("Dump aborted")
+			self.set_run_result("aborted")
+			return
+
+		result = "ok"
+
+		if self.gen_html:
+			try:
+				for dump_path in dump_paths:
+					dump = load_json(dump_path)
+					output_dir = os.path.join(self.html_dir_path, get_file_title_from_path(dump_path))
+					generate_html(self.db, dump, output_dir, self.thumbs_dir_path, self.thumb_list)
+			except Exception as ex:
+				# dump itself succeeded, html can be generated later with --html
+				print("HTML generation failed:", ex)
+				result = "ok, html error: %s" % ex
+
+		self.set_run_result(result)
+		print("Dump finished")
+
+	def handle_control_command(self, command: str) -> str:
+		words = command.split()
+		if len(words) == 0:
+			return "empty command"
+
+		if words[0] == CONTROL_CMD_STATUS:
+			return json.dumps(self.get_status(), indent='\t')
+
+		if words[0] == CONTROL_CMD_RUN:
+			set_names = words[1:] if len(words) > 1 else list(self.intervals)
+			for set_name in set_names:
+				if set_name not in self.intervals:
+					return "set \"%s\" is not scheduled" % set_name
+
+			with self.lock:
+				for set_name in set_names:
+					self.next_run[set_name] = 0
+			self.wake_up()
+			return "ok"
+
+		return "unknown command \"%s\"" % words[0]
+
+	def wake_up(self):
+		"""
+		Makes the main loop recheck schedule immediately instead of after the current wait timeout.
+		"""
+		try:
+			self.wakeup_wsock.send(b"\0")
+		except OSError:
+			# buffer is full, the main loop is going to wake up anyway
+			pass
+
+	def handle_control_connection(self):
+		try:
+			conn, _ = self.server_sock.accept()
+		except socket.timeout:
+			return
+
+		with conn:
+			conn.settimeout(CONTROL_TIMEOUT)
+			try:
+				command = conn.recv(CONTROL_MAX_MSG_LEN).decode()
+				conn.sendall(self.handle_control_command(command).encode())
+			except (OSError, UnicodeDecodeError) as ex:
+				print("Control connection failed:", ex)
+
+	def handle_signal(self, signum: int, frame):
+		if signum in (signal.SIGINT, signal.SIGTERM):
+			self.stop_requested = True
+		elif signum == signal.SIGUSR1:
+			for set_name in self.next_run:
+				self.next_run[set_name] = 0
+		elif signum == signal.SIGUSR2:
+			self.status_requested = True
+
+	def open_control_socket(self):
+		if os.path.exists(self.control_socket_path):
+			try:
+				send_control_command(self.root_dir, CONTROL_CMD_STATUS)
+			except (ConnectionRefusedError, FileNotFoundError):
+				# left over by a daemon that didn't exit cleanly
+				os.unlink(self.control_socket_path)
+			except OSError as ex:
+				# e.g. timeout - someone is listening, but doesn't respond. removing the socket could let two daemons
+				# write the same database
+				raise RuntimeError("Control socket %s exists and is not responding (%s), stop the other daemon or remove the socket" % (self.control_socket_path, ex))
+			else:
+				raise RuntimeError("Another daemon is already running in %s" % self.root_dir)
+
+		self.server_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.server_sock.bind(self.control_socket_path)
+		self.server_sock.listen()
+		# accept() times out periodically, so that control thread notices when the daemon stops
+		self.server_sock.settimeout(CONTROL_POLL_INTERVAL)
+
+		self.control_thread = threading.Thread(target=self.serve_control_socket, name="control", daemon=True)
+		self.control_thread.start()
+
+	def serve_control_socket(self):
+		while not self.stop_requested:
+			self.handle_control_connection()
+
+	def setup_signals(self):
+		# signal handlers only set flags. wakeup fd makes the selector return, so that the flags are handled
+		# immediately instead of after the current wait timeout
+		self.wakeup_rsock, self.wakeup_wsock = socket.socketpair()
+		self.wakeup_rsock.setblocking(False)
+		self.wakeup_wsock.setblocking(False)
+		signal.set_wakeup_fd(self.wakeup_wsock.fileno(), warn_on_full_buffer=False)
+		self.selector.register(self.wakeup_rsock, selectors.EVENT_READ)
+
+		for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2):
+			signal.signal(signum, self.handle_signal)
+
+	def compact_db_journal(self):
+		if not os.path.exists(get_db_journal_path(self.db_path)):
+			return
+
+		print("Compacting database journal")
+		try:
+			save_local_db(self.db, self.db_path, self.backups_dir_path, self.no_backup, datetime.now())
+		except OSError as ex:
+			# journal is kept, it will be replayed on next start
+			print("Cannot save database:", ex)
+
+	def cleanup(self):
+		self.stop_requested = True
+		if self.control_thread is not None:
+			self.control_thread.join()
+
+		if self.server_sock is not None:
+			self.server_sock.close()
+			os.unlink(self.control_socket_path)
+
+		self.compact_db_journal()
+
+		signal.set_wakeup_fd(-1)
+		self.selector.close()
+
+		for sock in (self.wakeup_rsock, self.wakeup_wsock):
+			if sock is not None:
+				sock.close()
+
+	def run_forever(self):
+		self.setup_signals()
+		self.open_control_socket()
+
+		print("Daemon started, control socket:", self.control_socket_path)
+
+		try:
+			while not self.stop_requested:
+				if self.status_requested:
+					self.status_requested = False
+					print(json.dumps(self.get_status(), indent='\t'))
+
+				now = time.time()
+				due_sets = [set_name for set_name, t in self.next_run.items() if t <= now]
+				if len(due_sets) > 0:
+					# run all due sets together, so that playlists present in several sets are fetched once
+					self.run(due_sets)
+					continue
+
+				timeout = min(self.next_run.values()) - now
+				# only wakeup socket is registered, control socket is served by control thread
+				if len(self.selector.select(timeout)) > 0:
+					try:
+						self.wakeup_rsock.recv(CONTROL_MAX_MSG_LEN)
+					except BlockingIOError:
+						pass
+		finally:
+			self.cleanup()
+
+		print("Daemon stopped")
+
+
+def send_control_command(root_dir: str, command: str) -> str:
+	"""
+	Sends a command to a daemon running in root_dir and returns its response.
+	"""
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+		sock.settimeout(CONTROL_TIMEOUT)
+		sock.connect(os.path.join(root_dir, FILENAME_CONTROL_SOCKET))
+		sock.sendall(command.encode())
+		sock.shutdown(socket.SHUT_WR)
+
+		response = b""
+		while True:
+			chunk = sock.recv(CONTROL_MAX_MSG_LEN)
+			if len(chunk) == 0:
+				break
+			response += chunk
+
+	return response.decode()
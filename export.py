@@ -0,0 +1,297 @@
+import os
+import csv
+import json
+import hashlib
+import sqlite3
+from datetime import datetime
+from typing import List, Set, Tuple
+
+from consts import *
+from json_util import load_json
+from local_db import iter_local_db_items
+from util import get_file_title_from_path, datetime_to_timestring
+
+EXPORT_FORMAT_NDJSON = "ndjson"
+EXPORT_FORMAT_CSV = "csv"
+EXPORT_FORMAT_PARQUET = "parquet"
+EXPORT_FORMATS = [EXPORT_FORMAT_NDJSON, EXPORT_FORMAT_CSV, EXPORT_FORMAT_PARQUET]
+
+EXPORT_KEY_VIDEO_ID = "videoId"
+EXPORT_KEY_SNAPSHOT_TIME = "snapshotTime"
+EXPORT_KEY_DUMP_NAME = "dumpName"
+EXPORT_KEY_PLAYLIST_ID = "playlistId"
+EXPORT_KEY_PLAYLIST_TITLE = "playlistTitle"
+
+
+PARQUET_BATCH_SIZE = 10000 # rows
+
+# (column name, parquet type name)
+SNAPSHOT_COLUMNS = [
+	(EXPORT_KEY_VIDEO_ID, "string"),
+	(EXPORT_KEY_SNAPSHOT_TIME, "int64"),
+	(JSON_KEY_STATUS, "string"),
+	(JSON_KEY_TITLE, "string"),
+	(JSON_KEY_CHANNEL_NAME, "string"),
+	(JSON_KEY_CHANNEL_ID, "string"),
+	(JSON_KEY_PUBLISHED, "int64"),
+	(JSON_KEY_DURATION, "int64"),
+	(JSON_KEY_DESCRIPTION, "string"),
+]
+
+PLAYLIST_ITEM_COLUMNS = [
+	(EXPORT_KEY_DUMP_NAME, "string"),
+	(JSON_KEY_DUMP_TIME, "int64"),
+	(EXPORT_KEY_PLAYLIST_ID, "string"),
+	(EXPORT_KEY_PLAYLIST_TITLE, "string"),
+	(EXPORT_KEY_VIDEO_ID, "string"),
+	(JSON_KEY_ADDED_TIME, "int64"),
+]
+
+
+def is_parquet_available() -> bool:
+	try:
+		import pyarrow
+		import pyarrow.parquet
+	except ImportError:
+		return False
+	return True
+
+
+class NdjsonRowWriter:
+	def __init__(self, path: str, columns: List[tuple]):
+		self.f = open(path, "w")
+
+	def write(self, row: object):
+		self.f.write(json.dumps(row))
+		self.f.write("\n")
+
+	def close(self):
+		self.f.close()
+
+
+class CsvRowWriter:
+	def __init__(self, path: str, columns: List[tuple]):
+		self.f = open(path, "w", newline="")
+		self.writer = csv.DictWriter(self.f, [name for name, _ in columns], extrasaction="ignore")
+		self.writer.writeheader()
+
+	def write(self, row: object):
+		self.writer.writerow(row)
+
+	def close(self):
+		self.f.close()
+
+
+class ParquetRowWriter:
+	"""
+	Buffers rows and writes them as parquet row groups of PARQUET_BATCH_SIZE rows, so that memory usage stays bounded.
+	"""
+
+	def __init__(self, path: str, columns: List[tuple]):
+		import pyarrow
+		import pyarrow.parquet
+
+		self.pyarrow = pyarrow
+		self.schema = pyarrow.schema([(name, getattr(pyarrow, type_name)()) for name, type_name in columns])
+		self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+		self.batch = []
+
+	def flush(self):
+		if len(self.batch) > 0:
+			self.writer.write_table(self.pyarrow.Table.from_pylist(self.batch, schema=self.schema))
+			self.batch = []
+
+	def write(self, row: object):
+		self.batch.append(row)
+		if len(self.batch) >= PARQUET_BATCH_SIZE:
+			self.flush()
+
+	def close(self):
+		self.flush()
+		self.writer.close()
+
+
+ROW_WRITERS = {
+	EXPORT_FORMAT_NDJSON: NdjsonRowWriter,
+	EXPORT_FORMAT_CSV: CsvRowWriter,
+	EXPORT_FORMAT_PARQUET: ParquetRowWriter,
+}
+
+
+class ExportState:
+	"""
+	Persistent state of incremental export: hashes of exported snapshots (see get_snapshot_row_hash()) and names of
+	exported dumps. Kept in an sqlite database in output directory, so that it doesn't have to fit into memory.
+	Changes are committed only at the end of a successful export.
+	"""
+
+	def __init__(self, state_path: str):
+		self.conn = sqlite3.connect(state_path)
+		self.conn.execute("CREATE TABLE IF NOT EXISTS exported_snapshots (vid_id TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (vid_id, hash)) WITHOUT ROWID")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS exported_dumps (name TEXT PRIMARY KEY NOT NULL)")
+
+	def get_exported_snapshots(self, vid_id: str) -> Set[str]:
+		return { row[0] for row in self.conn.execute("SELECT hash FROM exported_snapshots WHERE vid_id = ?", (vid_id,)) }
+
+	def add_exported_snapshot(self, vid_id: str, row_hash: str):
+		self.conn.execute("INSERT OR IGNORE INTO exported_snapshots VALUES (?, ?)", (vid_id, row_hash))
+
+	def is_dump_exported(self, dump_name: str) -> bool:
+		return self.conn.execute("SELECT 1 FROM exported_dumps WHERE name = ?", (dump_name,)).fetchone() is not None
+
+	def add_exported_dump(self, dump_name: str):
+		self.conn.execute("INSERT OR IGNORE INTO exported_dumps VALUES (?)", (dump_name,))
+
+	def commit(self):
+		self.conn.commit()
+
+	def close(self):
+		self.conn.close()
+
+
+def get_snapshot_row_hash(row: object) -> str:
+	"""
+	Hashes exported metadata of a snapshot row. Snapshot time is left out, as it is bumped by each dump that finds
+	the same metadata (see update_db()).
+	"""
+	values = [row[name] for name, _ in SNAPSHOT_COLUMNS[2:]]
+	return hashlib.blake2b(json.dumps(values).encode(), digest_size=8).hexdigest()
+
+
+def iter_snapshot_rows(db_path: str, state: ExportState = None):
+	"""
+	Yields one row per (video, snapshot), streaming the database (with database journal applied).
+
+	@state: if not None, only snapshots whose metadata was not exported yet are yielded, and they are added to state
+	"""
+	for vid_id, snapshots in iter_local_db_items(db_path):
+		exported_hashes = state.get_exported_snapshots(vid_id) if state is not None else None
+
+		for snapshot_time in sorted([int(key) for key in snapshots.keys()]):
+			snapshot = snapshots.get(str(snapshot_time))
+			if snapshot is None:
+				continue
+
+			row = { EXPORT_KEY_VIDEO_ID: vid_id, EXPORT_KEY_SNAPSHOT_TIME: snapshot_time }
+			for name, _ in SNAPSHOT_COLUMNS[2:]:
+				row[name] = snapshot.get(name)
+
+			if state is not None:
+				row_hash = get_snapshot_row_hash(row)
+				if row_hash in exported_hashes:
+					continue
+				exported_hashes.add(row_hash)
+				state.add_exported_snapshot(vid_id, row_hash)
+
+			yield row
+
+
+def iter_playlist_item_rows(dump_path: str):
+	"""
+	Yields one row per (playlist, video) contained in a dump.
+	"""
+	dump = load_json(dump_path)
+	if dump is None:
+		print("Cannot load dump file", dump_path)
+		return
+
+	dump_name = get_file_title_from_path(dump_path)
+	dump_time = dump.get(JSON_KEY_DUMP_TIME)
+
+	for playlist in dump.get(JSON_KEY_PLAYLISTS, []):
+		for video in playlist.get(JSON_KEY_VIDEOS, []):
+			yield {
+				EXPORT_KEY_DUMP_NAME: dump_name,
+				JSON_KEY_DUMP_TIME: dump_time,
+				EXPORT_KEY_PLAYLIST_ID: playlist.get(JSON_KEY_ID),
+				EXPORT_KEY_PLAYLIST_TITLE: playlist.get(JSON_KEY_TITLE),
+				EXPORT_KEY_VIDEO_ID: video.get(JSON_KEY_ID),
+				JSON_KEY_ADDED_TIME: video.get(JSON_KEY_ADDED_TIME),
+			}
+
+
+def get_unique_output_path(output_dir: str, file_title: str, export_format: str) -> str:
+	"""
+	Appends a counter to file title if a file with that name already exists, e.g. when exporting twice in a second.
+	"""
+	path = os.path.join(output_dir, "%s.%s" % (file_title, export_format))
+	counter = 1
+	while os.path.exists(path):
+		path = os.path.join(output_dir, "%s_%d.%s" % (file_title, counter, export_format))
+		counter += 1
+	return path
+
+
+def write_rows(rows, output_dir: str, file_title: str, export_format: str, columns: List[tuple]) -> Tuple[str, int]:
+	"""
+	Writes rows to a new file in output_dir. The file is created only when the first row comes, so that an export
+	with nothing new doesn't leave empty files behind.
+
+	@returns: tuple(path of written file or None if there were no rows, number of rows)
+	"""
+	path = None
+	row_cnt = 0
+	writer = None
+	try:
+		for row in rows:
+			if writer is None:
+				path = get_unique_output_path(output_dir, file_title, export_format)
+				writer = ROW_WRITERS[export_format](path, columns)
+			writer.write(row)
+			row_cnt += 1
+	finally:
+		if writer is not None:
+			writer.close()
+
+	return path, row_cnt
+
+
+def export_archive(root_dir: str, output_dir: str, export_format: str, incremental: bool):
+	"""
+	Exports database snapshots and dumps contents to flat row files in output_dir. Database is streamed and dumps are
+	loaded one at a time, so memory usage does not depend on archive size.
+
+	In incremental mode, export state (see ExportState) is kept in output_dir, and only snapshots with metadata that
+	was not exported yet, and dumps that were not exported yet, are exported. A snapshot whose time was only bumped
+	by later dumps is not exported again.
+	"""
+	db_path = os.path.join(root_dir, FILENAME_DB)
+	dumps_dir_path = os.path.join(root_dir, DIR_DUMPS)
+
+	os.makedirs(output_dir, exist_ok=True)
+
+	state = ExportState(os.path.join(output_dir, FILENAME_EXPORT_STATE)) if incremental else None
+	try:
+		time_now_str = datetime_to_timestring(datetime.now())
+
+		# snapshots
+		snapshot_rows = iter_snapshot_rows(db_path, state)
+		snapshots_path, row_cnt = write_rows(snapshot_rows, output_dir, "snapshots_" + time_now_str, export_format, SNAPSHOT_COLUMNS)
+
+		if snapshots_path is not None:
+			print("Exported", row_cnt, "snapshots to", snapshots_path)
+		else:
+			print("No new snapshots to export")
+
+		# dumps
+		dump_filenames = sorted(os.listdir(dumps_dir_path)) if os.path.isdir(dumps_dir_path) else []
+		new_dump_filenames = [f for f in dump_filenames if f.endswith(".json") and (state is None or not state.is_dump_exported(f))]
+
+		def iter_new_dumps_rows():
+			for dump_filename in new_dump_filenames:
+				yield from iter_playlist_item_rows(os.path.join(dumps_dir_path, dump_filename))
+				if state is not None:
+					state.add_exported_dump(dump_filename)
+
+		playlist_items_path, row_cnt = write_rows(iter_new_dumps_rows(), output_dir, "playlist_items_" + time_now_str, export_format, PLAYLIST_ITEM_COLUMNS)
+
+		if playlist_items_path is not None:
+			print("Exported", row_cnt, "playlist items from", len(new_dump_filenames), "dumps to", playlist_items_path)
+		else:
+			print("No new playlist items to export")
+
+		if state is not None:
+			state.commit()
+	finally:
+		if state is not None:
+			state.close()
@@ -0,0 +1,425 @@
+import os
+import json
+import shutil
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, Set, Tuple
+
+from consts import *
+from json_util import load_json, save_json
+from local_db import can_overwrite_snapshot, get_db_journal_path, iter_local_db_items
+from util import get_file_title_from_path, datetime_to_timestring
+
+PROBLEM_DB_UNREADABLE = "database cannot be parsed"
+PROBLEM_DUPLICATE_KEY = "duplicate keys in database object"
+PROBLEM_BAD_VIDEO = "video entry is not an object or has no snapshots"
+PROBLEM_BAD_SNAPSHOT = "snapshot is not an object"
+PROBLEM_BAD_TIMESTAMP = "snapshot timestamp key is not a number"
+PROBLEM_UNNORMALIZED_TIMESTAMP = "snapshot timestamp key is not normalized"
+PROBLEM_TIMESTAMP_COLLISION = "more snapshots with the same timestamp"
+PROBLEM_CONFLICTING_SNAPSHOT = "colliding snapshots differ and cannot be merged"
+PROBLEM_MISSING_STATUS = "snapshot without status"
+PROBLEM_DUPLICATE_SNAPSHOT = "snapshot duplicated by a newer one"
+PROBLEM_DUMP_UNREADABLE = "dump cannot be parsed or has wrong structure"
+PROBLEM_DUMP_MISSING_KEY = "dump or playlist missing required key"
+PROBLEM_DUMP_VIDEO_NO_ID = "dump video without id"
+PROBLEM_DUMP_REF_MISSING = "dump refers to video missing from database"
+PROBLEM_THUMB_ORPHAN = "thumbnail of video missing from database"
+
+MAX_EXAMPLES = 5 # per problem type
+
+
+class FsckReport:
+	def __init__(self):
+		self.counts = Counter()
+		self.examples = {}
+
+	def add(self, problem: str, example: str, count: int = 1):
+		self.counts[problem] += count
+		examples = self.examples.setdefault(problem, [])
+		if len(examples) < MAX_EXAMPLES:
+			examples.append(example)
+
+	def merge(self, counts: Counter, examples: dict):
+		for problem, count in counts.items():
+			self.counts[problem] += count
+			self.examples[problem] = (self.examples.get(problem, []) + examples.get(problem, []))[:MAX_EXAMPLES]
+
+	def print(self):
+		if len(self.counts) == 0:
+			print("No problems found")
+			return
+
+		for problem, count in self.counts.most_common():
+			print("%s: %d" % (problem, count))
+			for example in self.examples.get(problem, []):
+				print("  " + example)
+
+
+class DuplicateKeysObject(dict):
+	"""
+	Decoded json object with duplicate keys. Behaves as json.load() would decode it (the last value of each key wins),
+	but keeps all key-value pairs in order, so that no value is lost.
+	"""
+
+	def __init__(self, pairs: List[tuple]):
+		super().__init__(pairs)
+		self.pairs = pairs
+
+
+def get_object_pairs(obj: dict) -> List[tuple]:
+	return obj.pairs if isinstance(obj, DuplicateKeysObject) else list(obj.items())
+
+
+def check_video(vid_id: str, snapshots: object, report: FsckReport, quarantined: dict) -> object:
+	"""
+	Checks a single database entry.
+
+	@quarantined: dictionary mapping video id to list of quarantined values, snapshots that collide with another
+		snapshot and can't be merged with it are added to it
+
+	@returns: repaired snapshots (dictionary mapping timestamp to video metadata), or None if the entry can't be
+		repaired and should be quarantined
+	"""
+	if not isinstance(snapshots, dict) or len(snapshots) == 0:
+		report.add(PROBLEM_BAD_VIDEO, vid_id)
+		return None
+
+	normalized = {}
+	for snapshot_timestamp, snapshot in get_object_pairs(snapshots):
+		if not isinstance(snapshot, dict):
+			report.add(PROBLEM_BAD_SNAPSHOT, "%s %s" % (vid_id, snapshot_timestamp))
+			return None
+
+		try:
+			int_timestamp = int(snapshot_timestamp)
+		except ValueError:
+			report.add(PROBLEM_BAD_TIMESTAMP, "%s %s" % (vid_id, snapshot_timestamp))
+			return None
+
+		if str(int_timestamp) != snapshot_timestamp:
+			report.add(PROBLEM_UNNORMALIZED_TIMESTAMP, "%s %s" % (vid_id, snapshot_timestamp))
+
+		existing_snapshot = normalized.get(int_timestamp)
+		if existing_snapshot is not None:
+			# e.g. "100" and "0100", or duplicate keys. same as in update_db: keep the snapshot that contains the other one
+			report.add(PROBLEM_TIMESTAMP_COLLISION, "%s %s" % (vid_id, snapshot_timestamp))
+			if can_overwrite_snapshot(snapshot, existing_snapshot):
+				continue
+			if not can_overwrite_snapshot(existing_snapshot, snapshot):
+				report.add(PROBLEM_CONFLICTING_SNAPSHOT, "%s %s" % (vid_id, snapshot_timestamp))
+				quarantined.setdefault(vid_id, []).append({ snapshot_timestamp: snapshot })
+				continue
+
+		normalized[int_timestamp] = snapshot
+
+	for int_timestamp, snapshot in normalized.items():
+		if JSON_KEY_STATUS not in snapshot:
+			report.add(PROBLEM_MISSING_STATUS, "%s %d" % (vid_id, int_timestamp))
+			snapshot = dict(snapshot)
+			snapshot[JSON_KEY_STATUS] = STATUS_UNSPEC
+			normalized[int_timestamp] = snapshot
+
+	# same as in update_db: a snapshot that can be overwritten by a newer one only needs the newer timestamp
+	out = {}
+	newer_snapshots = []
+	for int_timestamp in sorted(normalized.keys(), reverse=True):
+		snapshot = normalized[int_timestamp]
+		if any(can_overwrite_snapshot(snapshot, newer_snapshot) for newer_snapshot in newer_snapshots):
+			report.add(PROBLEM_DUPLICATE_SNAPSHOT, "%s %d" % (vid_id, int_timestamp))
+			continue
+
+		newer_snapshots.append(snapshot)
+		out[str(int_timestamp)] = snapshot
+
+	return dict(sorted(out.items(), key=lambda k: int(k[0])))
+
+
+def check_dump(dump_path: str) -> Tuple[Counter, dict, Set[str]]:
+	"""
+	Checks a single dump file. Runs in a worker process.
+
+	@returns: tuple(
+		problem counts,
+		problem examples,
+		set of video ids referenced by the dump (None if the dump can't be parsed or doesn't have dump structure),
+	)
+	"""
+	report = FsckReport()
+	dump_name = get_file_title_from_path(dump_path)
+
+	dump = load_json(dump_path)
+	if not isinstance(dump, dict):
+		report.add(PROBLEM_DUMP_UNREADABLE, dump_name)
+		return report.counts, report.examples, None
+
+	for required_key in [JSON_KEY_PLAYLISTS, JSON_KEY_DUMP_TIME]:
+		if required_key not in dump:
+			report.add(PROBLEM_DUMP_MISSING_KEY, "%s: %s" % (dump_name, required_key))
+
+	# a dump that parses but has a different structure can't be used by anything, it's treated as unreadable
+	playlists = dump.get(JSON_KEY_PLAYLISTS, [])
+	if not isinstance(playlists, list) or not all(isinstance(playlist, dict) for playlist in playlists):
+		report.add(PROBLEM_DUMP_UNREADABLE, "%s: %s is not a list of objects" % (dump_name, JSON_KEY_PLAYLISTS))
+		return report.counts, report.examples, None
+
+	vid_ids = set()
+	for playlist in playlists:
+		playlist_id = playlist.get(JSON_KEY_ID)
+		for required_key in [JSON_KEY_TITLE, JSON_KEY_VIDEOS]:
+			if required_key not in playlist:
+				report.add(PROBLEM_DUMP_MISSING_KEY, "%s: playlist %s: %s" % (dump_name, playlist_id, required_key))
+
+		videos = playlist.get(JSON_KEY_VIDEOS, [])
+		if not isinstance(videos, list) or not all(isinstance(video, dict) for video in videos):
+			report.add(PROBLEM_DUMP_UNREADABLE, "%s: playlist %s: %s is not a list of objects" % (dump_name, playlist_id, JSON_KEY_VIDEOS))
+			return report.counts, report.examples, None
+
+		for video in videos:
+			if not isinstance(video.get(JSON_KEY_ID), str):
+				report.add(PROBLEM_DUMP_VIDEO_NO_ID, "%s: playlist %s" % (dump_name, playlist_id))
+				continue
+			vid_ids.add(video[JSON_KEY_ID])
+
+	return report.counts, report.examples, vid_ids
+
+
+def write_db_entry(f, vid_id: str, snapshots: object, first: bool):
+	"""
+	Writes a single database entry, formatted the same way as save_json() would format the whole database.
+	"""
+	entry = json.dumps({ vid_id: snapshots }, indent='\t')
+	if not first:
+		f.write(",")
+	f.write(entry[1:-2]) # strip outer braces, keep the leading newline
+
+
+def scan_db(db_path: str, report: FsckReport, f_out, quarantined: dict, duplicated_ids: Set[str]) -> Tuple[Set[str], Set[str], bool]:
+	"""
+	Streams the database once (with database journal applied), checking each entry, and writes the repaired database
+	to f_out (if not None).
+
+	@duplicated_ids: ids of videos with more than one entry in the database. Their entries are collected instead of
+		written, and merged into a single entry at the end.
+
+	@returns: tuple(
+		set of video ids in the repaired database,
+		set of video ids with more than one entry,
+		True if the repaired database differs from the original one,
+	)
+	"""
+	duplicate_key_cnt = 0
+
+	def detect_duplicate_keys(pairs: List[tuple]) -> dict:
+		nonlocal duplicate_key_cnt
+		out = dict(pairs)
+		if len(out) < len(pairs):
+			duplicate_key_cnt += len(pairs) - len(out)
+			out = DuplicateKeysObject(pairs)
+		return out
+
+	seen_ids = set()
+	vid_ids = set()
+	found_duplicated_ids = set()
+	duplicated_entries = {}
+	modified = False
+
+	def check_entry(vid_id: str, snapshots: object):
+		nonlocal modified
+		repaired = check_video(vid_id, snapshots, report, quarantined)
+		if repaired is None:
+			quarantined.setdefault(vid_id, []).append(get_object_pairs(snapshots) if isinstance(snapshots, DuplicateKeysObject) else snapshots)
+			modified = True
+			return
+
+		if repaired != snapshots or isinstance(snapshots, DuplicateKeysObject):
+			modified = True
+
+		if f_out is not None:
+			write_db_entry(f_out, vid_id, repaired, len(vid_ids) == 0)
+		vid_ids.add(vid_id)
+
+	if f_out is not None:
+		f_out.write("{")
+
+	for vid_id, snapshots in iter_local_db_items(db_path, object_pairs_hook=detect_duplicate_keys):
+		if vid_id in seen_ids:
+			found_duplicated_ids.add(vid_id)
+			duplicate_key_cnt += 1
+
+		if duplicate_key_cnt > 0:
+			report.add(PROBLEM_DUPLICATE_KEY, vid_id, duplicate_key_cnt)
+			duplicate_key_cnt = 0
+			modified = True
+
+		seen_ids.add(vid_id)
+
+		if vid_id in duplicated_ids:
+			duplicated_entries.setdefault(vid_id, []).append(snapshots)
+			continue
+
+		check_entry(vid_id, snapshots)
+
+	# snapshots of all entries of a video are merged, as if they were a single entry with duplicate timestamp keys
+	for vid_id, entries in duplicated_entries.items():
+		merged_pairs = []
+		for snapshots in entries:
+			if isinstance(snapshots, dict):
+				merged_pairs += get_object_pairs(snapshots)
+			else:
+				report.add(PROBLEM_BAD_VIDEO, vid_id)
+				quarantined.setdefault(vid_id, []).append(snapshots)
+
+		if len(merged_pairs) > 0:
+			check_entry(vid_id, DuplicateKeysObject(merged_pairs))
+
+	if f_out is not None:
+		f_out.write("\n}" if len(vid_ids) > 0 else "}")
+
+	return vid_ids, found_duplicated_ids, modified
+
+
+def check_db(root_dir: str, report: FsckReport, repair: bool, quarantine_dir: str, time_now: datetime) -> Set[str]:
+	"""
+	Checks the database in a streaming pass. When repairing, the repaired database is written to a temporary file
+	along the way, and replaces the database at the end (after backing it up). A video with more than one entry is
+	only found after its first entry was already checked, so if there are any, the database is scanned once more,
+	merging them.
+
+	@returns: set of video ids in the database, or None if the database can't be parsed
+	"""
+	db_path = os.path.join(root_dir, FILENAME_DB)
+	tmp_db_path = db_path + ".tmp"
+
+	duplicated_ids = set()
+	while True:
+		pass_report = FsckReport()
+		quarantined = {}
+
+		f_out = open(tmp_db_path, "w") if repair else None
+		try:
+			vid_ids, found_duplicated_ids, modified = scan_db(db_path, pass_report, f_out, quarantined, duplicated_ids)
+		except json.JSONDecodeError as ex:
+			pass_report.add(PROBLEM_DB_UNREADABLE, str(ex))
+			vid_ids = None
+			break
+		finally:
+			if f_out is not None:
+				f_out.close()
+
+		if found_duplicated_ids == duplicated_ids:
+			break
+
+		print("Found videos with more than one database entry, checking database again to merge them")
+		duplicated_ids = found_duplicated_ids
+
+	report.merge(pass_report.counts, pass_report.examples)
+
+	if not repair:
+		return vid_ids
+
+	if vid_ids is None or not modified:
+		# nothing to repair, or the database is too broken to be repaired automatically
+		os.unlink(tmp_db_path)
+		return vid_ids
+
+	if len(quarantined) > 0:
+		# maps video id to list of quarantined entries and snapshots, as a video may have more of them
+		quarantine_path = os.path.join(quarantine_dir, FILENAME_DB)
+		print("Quarantining", sum([len(values) for values in quarantined.values()]), "database entries and snapshots to", quarantine_path)
+		os.makedirs(quarantine_dir, exist_ok=True)
+		save_json(quarantined, quarantine_path)
+
+	backup_path = os.path.join(root_dir, DIR_BACKUPS, "%s_%s.json" % (get_file_title_from_path(db_path), datetime_to_timestring(time_now)))
+	print("Backing up database to", backup_path)
+	os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+	shutil.copy2(db_path, backup_path)
+	os.replace(tmp_db_path, db_path)
+
+	return vid_ids
+
+
+def check_dumps(root_dir: str, report: FsckReport, repair: bool, quarantine_dir: str, vid_ids: Set[str]):
+	"""
+	Checks all dump files in parallel, then checks their references against the database.
+	"""
+	dumps_dir_path = os.path.join(root_dir, DIR_DUMPS)
+	if not os.path.isdir(dumps_dir_path):
+		return
+
+	dump_paths = [os.path.join(dumps_dir_path, f) for f in sorted(os.listdir(dumps_dir_path)) if f.endswith(".json")]
+
+	with ProcessPoolExecutor() as executor:
+		for dump_path, (counts, examples, dump_vid_ids) in zip(dump_paths, executor.map(check_dump, dump_paths)):
+			report.merge(counts, examples)
+
+			if dump_vid_ids is None:
+				if repair:
+					print("Quarantining", dump_path)
+					os.makedirs(os.path.join(quarantine_dir, DIR_DUMPS), exist_ok=True)
+					shutil.move(dump_path, os.path.join(quarantine_dir, DIR_DUMPS, os.path.basename(dump_path)))
+				continue
+
+			if vid_ids is not None:
+				for vid_id in dump_vid_ids - vid_ids:
+					report.add(PROBLEM_DUMP_REF_MISSING, "%s: %s" % (get_file_title_from_path(dump_path), vid_id))
+
+
+def check_thumbs(root_dir: str, report: FsckReport, repair: bool, quarantine_dir: str, vid_ids: Set[str]):
+	thumbs_dir_path = os.path.join(root_dir, DIR_THUMBS)
+	if not os.path.isdir(thumbs_dir_path):
+		return
+
+	with os.scandir(thumbs_dir_path) as entries:
+		orphans = [entry.name for entry in entries if get_file_title_from_path(entry.name) not in vid_ids]
+
+	for thumb_filename in orphans:
+		report.add(PROBLEM_THUMB_ORPHAN, thumb_filename)
+
+	if repair and len(orphans) > 0:
+		print("Quarantining", len(orphans), "thumbnails")
+		os.makedirs(os.path.join(quarantine_dir, DIR_THUMBS), exist_ok=True)
+		for thumb_filename in orphans:
+			shutil.move(os.path.join(thumbs_dir_path, thumb_filename), os.path.join(quarantine_dir, DIR_THUMBS, thumb_filename))
+
+
+def fsck(root_dir: str, repair: bool) -> bool:
+	"""
+	Checks consistency of the database, dumps and thumbnails. The database is streamed and dumps are checked in
+	parallel, one dump per task, so memory usage stays bounded (apart from the set of video ids).
+
+	When repairing, database keys are normalized, missing statuses are set to unspecified, duplicate snapshots are
+	merged, and broken database entries, snapshots colliding with a different snapshot, unparseable dumps and orphaned
+	thumbnails are moved to quarantine directory.
+	References from dumps to videos missing from the database can't be repaired, they are only reported.
+
+	@returns: True if no problems were found
+	"""
+	if repair and os.path.exists(os.path.join(root_dir, FILENAME_CONTROL_SOCKET)):
+		print("Daemon seems to be running, stop it before repairing")
+		return False
+
+	if repair and os.path.exists(get_db_journal_path(os.path.join(root_dir, FILENAME_DB))):
+		print("Database journal exists, run a dump (or start and stop the daemon) to merge it before repairing")
+		return False
+
+	time_now = datetime.now()
+	quarantine_dir = os.path.join(root_dir, DIR_QUARANTINE, datetime_to_timestring(time_now))
+	report = FsckReport()
+
+	vid_ids = None
+	if os.path.exists(os.path.join(root_dir, FILENAME_DB)):
+		print("Checking database")
+		vid_ids = check_db(root_dir, report, repair, quarantine_dir, time_now)
+
+	print("Checking dumps")
+	check_dumps(root_dir, report, repair, quarantine_dir, vid_ids)
+
+	if vid_ids is not None:
+		print("Checking thumbnails")
+		check_thumbs(root_dir, report, repair, quarantine_dir, vid_ids)
+
+	report.print()
+
+	return len(report.counts) == 0
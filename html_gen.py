@@ -1,9 +1,10 @@
 import os
 import re
 from datetime import datetime
-from typing import Tuple
+from typing import Dict, List, Tuple, Set
 
 from consts import *
+from local_db import iter_local_db_items
 from util import sanitize_filename, get_thumb_list
 
 
@@ -70,6 +71,7 @@ def select_snapshot(snapshots: object, requested_timestamp: int) -> Tuple[object
 	we have any data to display.
 
 	Note: unfortunately json keys are strings - convert them to ints for sorting
+	Note: the database is not modified, as it might be kept in memory and saved later
 
 	@snapshots: dictionary mapping timestamp to video metadata
 	@requested_timestamp: requested timestamp
@@ -80,6 +82,7 @@ def select_snapshot(snapshots: object, requested_timestamp: int) -> Tuple[object
 	)
 	"""
 	int_keys = sorted([int(key) for key in snapshots.keys()])
+	real_status = None
 
 	for snapshot_timestamp in int_keys:
 		if snapshot_timestamp >= requested_timestamp:
@@ -87,7 +90,8 @@ def select_snapshot(snapshots: object, requested_timestamp: int) -> Tuple[object
 
 			snapshot = snapshots[str(snapshot_timestamp)]
 
-			real_status = snapshots[str(snapshot_timestamp)][JSON_KEY_STATUS]
+			# status is missing in a broken database, see fsck
+			real_status = snapshots[str(snapshot_timestamp)].get(JSON_KEY_STATUS, STATUS_UNSPEC)
 			if not is_snapshot_useful(real_status):
 				# this snapshot does not contain any meaningful data, only status is relevant
 				break
@@ -99,8 +103,9 @@ def select_snapshot(snapshots: object, requested_timestamp: int) -> Tuple[object
 	# or we found it but it was private/unspecified and didn't contain data.
 	# just select any snapshot that contains data
 	for snapshot_timestamp, snapshot in snapshots.items():
-		if is_snapshot_useful(snapshot[JSON_KEY_STATUS]):
+		if is_snapshot_useful(snapshot.get(JSON_KEY_STATUS)):
 			if real_status is not None:
+				snapshot = dict(snapshot)
 				snapshot[JSON_KEY_STATUS] = real_status
 			return snapshot, int(snapshot_timestamp)
 
@@ -115,183 +120,291 @@ def select_snapshot(snapshots: object, requested_timestamp: int) -> Tuple[object
 	return out, None
 
 
-def generate_html(db: object, dump: object, output_dir: str, thumbs_dir_path: str):
-	os.makedirs(output_dir, exist_ok=True)
+def describe_video(snapshots: object) -> str:
+	"""
+	Returns a short description of a video: current status and latest known title and channel name.
+	"""
+	if len(snapshots) == 0:
+		return ""
 
-	print("Writing to", output_dir)
+	vid_meta, _ = select_snapshot(snapshots, max([int(key) for key in snapshots.keys()]))
+	return "(%s) \"%s\" by %s" % (vid_meta.get(JSON_KEY_STATUS, STATUS_UNSPEC), vid_meta.get(JSON_KEY_TITLE, UNKNOWN_NAME), vid_meta.get(JSON_KEY_CHANNEL_NAME, UNKNOWN_NAME))
 
-	for required_key in [JSON_KEY_PLAYLISTS, JSON_KEY_DUMP_TIME]:
-		if required_key not in dump:
-			print("\"%s\" missing from dump, aborting" % required_key)
-			return
 
-	thumb_list = get_thumb_list(thumbs_dir_path)
+def describe_videos(db_path: str, vid_ids: set) -> Dict[str, str]:
+	"""
+	Streams the database and returns a short description of selected videos, see describe_video().
+	"""
+	descriptions = {}
+	for vid_id, snapshots in iter_local_db_items(db_path):
+		if vid_id in vid_ids:
+			descriptions[vid_id] = describe_video(snapshots)
+
+	return descriptions
 
-	dump_time = dump[JSON_KEY_DUMP_TIME]
-	dump_time_str = timestamp_to_datestring(dump_time)
 
-	for playlist in dump[JSON_KEY_PLAYLISTS]:
-		for required_key in [JSON_KEY_TITLE, JSON_KEY_VIDEOS]:
-			if required_key not in playlist:
-				print("\"%s\" missing from playlist, skipping" % required_key)
-				continue
+def render_table_header() -> str:
+	return """
+<table border="1" cellpadding="5" cellspacing="0">
+<tr>
+	<th>Thumbnail</th>
+	<th width="600">Metadata</th>
+	<th width="600">Description</th>
+</tr>
+"""
+
+
+def render_video_row(vid_id: str, vid_meta: object, vid_meta_timestamp: int, added_time: int, dump_time: int, thumb_list: Set[str], thumbs_url: str, history_url: str = None) -> str:
+	"""
+	Renders a single row of videos table.
+
+	@vid_meta: selected snapshot of video metadata (can be empty)
+	@vid_meta_timestamp: timestamp of selected snapshot or None
+	@added_time: time the video was added to playlist or None
+	@dump_time: dump time, used to mark snapshot taken at dump time, or None
+	@thumbs_url: url of thumbnails directory, relative to rendered page
+	@history_url: url of snapshot history page of this video, if it should be linked
+	"""
+	vid_url = "https://www.youtube.com/watch?v=" + vid_id
+
+	out_video = "<tr><td>"
+
+	# thumbnail
+
+	if vid_id in thumb_list:
+		out_video += "<a href=\"%s\"><img src=\"%s/%s.jpg\" width=\"400\" /></a>" % (vid_url, thumbs_url, vid_id)
+
+	out_video += "</td><td>"
+
+	# metadata
+
+	if JSON_KEY_TITLE in vid_meta:
+		vid_title = sanitize_display_string(vid_meta[JSON_KEY_TITLE])
+	else:
+		vid_title = UNKNOWN_NAME
+
+	out_video += "\n<b>Title</b>: <a href=\"%s\">%s</a>" % (vid_url, vid_title)
+
+	channel_url = None
+	if JSON_KEY_CHANNEL_ID in vid_meta:
+		channel_url = get_channel_url_from_id(vid_meta[JSON_KEY_CHANNEL_ID])
+
+	# note: in the past yt used to have channel urls like "https://youtube.com/user/ChannelName",
+	# but it doesn't seem to work anymore. keep username in JSON_KEY_CHANNEL_USERNAME just in case
+
+	channel_name = None
+	if JSON_KEY_CHANNEL_NAME in vid_meta:
+		channel_name = sanitize_display_string(vid_meta[JSON_KEY_CHANNEL_NAME])
+
+	if channel_url is not None and channel_name is not None:
+		out_video += "<br />\n<b>Channel</b>: <a href=\"%s\">%s</a>" % (channel_url, channel_name)
+	elif channel_url is None and channel_name is not None:
+		out_video += "<br />\n<b>Channel</b>: %s" % channel_name
+	elif channel_url is not None:
+		out_video += "<br />\n<b>Channel</b>: <a href=\"%s\">%s</a>" % (channel_url, UNKNOWN_NAME)
+
+	if JSON_KEY_DURATION in vid_meta:
+		out_video += "<br />\n<b>Duration</b>: " + duration_to_timestring(vid_meta[JSON_KEY_DURATION])
+
+	if JSON_KEY_STATUS in vid_meta:
+		vid_status = vid_meta[JSON_KEY_STATUS]
+		color = status_str_to_color(vid_status)
+		out_video += "<br />\n<b>Status</b>: <span style=\"color: %s;\">%s</span>" % (color, vid_status)
 
-		playlist_title = playlist[JSON_KEY_TITLE]
-		output_path = os.path.join(output_dir, sanitize_filename(playlist_title) + ".html")
+	out_video += "<br />\n<b>Thumbs</b>: "
+	out_video += "<a href=\"https://i.ytimg.com/vi/%s/default.jpg\">[1]</a> " % vid_id
+	out_video += "<a href=\"https://i.ytimg.com/vi/%s/mqdefault.jpg\">[2]</a> " % vid_id
+	out_video += "<a href=\"https://i.ytimg.com/vi/%s/hqdefault.jpg\">[3]</a> " % vid_id
+	out_video += "<a href=\"https://i.ytimg.com/vi/%s/sddefault.jpg\">[4]</a> " % vid_id
+	out_video += "<a href=\"https://i.ytimg.com/vi/%s/maxresdefault.jpg\">[5]</a> " % vid_id
 
-		print("Processing", playlist_title)
+	if JSON_KEY_PUBLISHED in vid_meta:
+		out_video += "<br />\n<b>Published</b>: %s" % timestamp_to_datestring(vid_meta[JSON_KEY_PUBLISHED])
 
-		playlist_title = sanitize_display_string(playlist_title)
+	if added_time is not None:
+		out_video += "<br />\n<b>Added to playlist</b>: %s" % timestamp_to_datestring(added_time)
 
-		### header ###
-		out_html = "<!DOCTYPE html>\n<html>\n<head>\n<title>%s</title>\n</head>\n<body>\n" % playlist_title
+	if vid_meta_timestamp is not None:
+		out_video += "<br />\n<b>Snapshot taken</b>: %s" % timestamp_to_datestring(vid_meta_timestamp)
+		if vid_meta_timestamp == dump_time:
+			out_video += " (dump time)"
 
-		### playlist info ###
+	if history_url is not None:
+		out_video += "<br />\n<b>Snapshots</b>: <a href=\"%s\">history</a>" % history_url
 
-		out_info = "<b>Dump time</b>: %s" % dump_time_str
+	out_video += "\n</td><td>"
 
-		if JSON_KEY_ID in playlist:
-			playlist_url = "https://www.youtube.com/playlist?list=" + playlist[JSON_KEY_ID]
-			out_info += "<br />\n<b>Title</b>: <a href=\"%s\">%s</a>" % (playlist_url, playlist_title)
+	# description
+
+	if JSON_KEY_DESCRIPTION in vid_meta:
+		out_video += add_newlines(sanitize_display_string(vid_meta[JSON_KEY_DESCRIPTION]))
+
+	out_video += "</td></tr>"
+
+	return out_video
+
+
+def render_playlist_html(db: object, playlist: object, dump_time: int, thumb_list: Set[str], thumbs_url: str, history_url_format: str = None) -> str:
+	"""
+	Renders a html page of a single playlist from a dump.
+
+	@thumbs_url: url of thumbnails directory, relative to rendered page
+	@history_url_format: format string of video snapshot history page url (with video id as its only argument),
+		if videos should link to it
+
+	@returns: html string, or None if playlist is missing required keys
+	"""
+	for required_key in [JSON_KEY_TITLE, JSON_KEY_VIDEOS]:
+		if required_key not in playlist:
+			print("\"%s\" missing from playlist, skipping" % required_key)
+			return None
+
+	playlist_title = sanitize_display_string(playlist[JSON_KEY_TITLE])
+
+	### header ###
+	out_html = "<!DOCTYPE html>\n<html>\n<head>\n<title>%s</title>\n</head>\n<body>\n" % playlist_title
+
+	### playlist info ###
+
+	out_info = "<b>Dump time</b>: %s" % timestamp_to_datestring(dump_time)
+
+	if JSON_KEY_ID in playlist:
+		playlist_url = "https://www.youtube.com/playlist?list=" + playlist[JSON_KEY_ID]
+		out_info += "<br />\n<b>Title</b>: <a href=\"%s\">%s</a>" % (playlist_url, playlist_title)
+	else:
+		out_info += "<br />\n<b>Title</b>: %s" % playlist_title
+
+	if JSON_KEY_CHANNEL_NAME in playlist:
+		channel_name = sanitize_display_string(playlist[JSON_KEY_CHANNEL_NAME])
+		if JSON_KEY_CHANNEL_ID in playlist:
+			channel_url = get_channel_url_from_id(playlist[JSON_KEY_CHANNEL_ID])
+			out_info += "<br />\n<b>Channel</b>: <a href=\"%s\">%s</a>" % (channel_url, channel_name)
 		else:
-			out_info += "<br />\n<b>Title</b>: %s" % playlist_title
+			out_info += "<br />\n<b>Channel</b>: %s" % channel_name
 
-		if JSON_KEY_CHANNEL_NAME in playlist:
-			channel_name = sanitize_display_string(playlist[JSON_KEY_CHANNEL_NAME])
-			if JSON_KEY_CHANNEL_ID in playlist:
-				channel_url = get_channel_url_from_id(playlist[JSON_KEY_CHANNEL_ID])
-				out_info += "<br />\n<b>Channel</b>: <a href=\"%s\">%s</a>" % (channel_url, channel_name)
-			else:
-				out_info += "<br />\n<b>Channel</b>: %s" % channel_name
+	if JSON_KEY_STATUS in playlist:
+		color = status_str_to_color(playlist[JSON_KEY_STATUS])
+		out_info += "<br />\n<b>Status</b>: <span style=\"color: %s;\">%s</span>" % (color, playlist[JSON_KEY_STATUS])
 
-		if JSON_KEY_STATUS in playlist:
-			color = status_str_to_color(playlist[JSON_KEY_STATUS])
-			out_info += "<br />\n<b>Status</b>: <span style=\"color: %s;\">%s</span>" % (color, playlist[JSON_KEY_STATUS])
+	if JSON_KEY_DESCRIPTION in playlist:
+		out_info += "<br />\n<b>Description</b>: %s" % add_newlines(sanitize_display_string(playlist[JSON_KEY_DESCRIPTION]))
 
-		if JSON_KEY_DESCRIPTION in playlist:
-			out_info += "<br />\n<b>Description</b>: %s" % add_newlines(sanitize_display_string(playlist[JSON_KEY_DESCRIPTION]))
+	### videos table ###
 
-		### videos table ###
+	out_table = render_table_header()
 
-		out_table = """
-<table border="1" cellpadding="5" cellspacing="0">
-<tr>
-	<th>Thumbnail</th>
-	<th width="600">Metadata</th>
-	<th width="600">Description</th>
-</tr>
-"""
+	status_counts = { key: 0 for key in KNOWN_STATUSES }
 
-		status_counts = { key: 0 for key in KNOWN_STATUSES }
+	for video in playlist[JSON_KEY_VIDEOS]:
+		if JSON_KEY_ID not in video:
+			print("Video missing id, skipping")
+			continue
 
-		for video in playlist[JSON_KEY_VIDEOS]:
-			if JSON_KEY_ID not in video:
-				print("Video missing id, skipping")
-				continue
+		vid_id = video[JSON_KEY_ID]
 
-			vid_id = video[JSON_KEY_ID]
+		# find video metadata in database
+		if vid_id not in db:
+			print("Cannot find in database:", vid_id)
+			vid_meta, vid_meta_timestamp = {}, None
+		else:
+			# select the correct snapshot
+			vid_meta, vid_meta_timestamp = select_snapshot(db[vid_id], dump_time)
 
-			# find video metadata in database
-			if vid_id not in db:
-				print("Cannot find in database:", vid_id)
-			else:
-				# select the correct snapshot
-				vid_meta, vid_meta_timestamp = select_snapshot(db[vid_id], dump_time)
+		vid_status = vid_meta.get(JSON_KEY_STATUS)
+		if vid_status in KNOWN_STATUSES:
+			status_counts[vid_status] += 1
+		else:
+			status_counts[STATUS_UNSPEC] += 1
 
-			vid_url = "https://www.youtube.com/watch?v=" + vid_id
+		history_url = history_url_format % vid_id if history_url_format is not None else None
+		out_table += render_video_row(vid_id, vid_meta, vid_meta_timestamp, video.get(JSON_KEY_ADDED_TIME), dump_time, thumb_list, thumbs_url, history_url)
 
-			out_video = "<tr><td>"
+	### end table ###
+	out_table += "</table>\n"
 
-			# thumbnail
+	out_info += "<br />\n<b>Contents status</b>:"
+	for status, count in status_counts.items():
+		if count < 1:
+			continue
+		out_info += "<br />\n%s: %d" % (status, count)
 
-			if vid_id in thumb_list:
-				out_video += "<a href=\"%s\"><img src=\"../../%s/%s.jpg\" width=\"400\" /></a>" % (vid_url, DIR_THUMBS, vid_id)
+	out_html += out_info
+	out_html += out_table
+	out_html += "</body>\n</html>\n"
 
-			out_video += "</td><td>"
+	return out_html
 
-			# metadata
 
-			if JSON_KEY_TITLE in vid_meta:
-				vid_title = sanitize_display_string(vid_meta[JSON_KEY_TITLE])
-			else:
-				vid_title = UNKNOWN_NAME
+def render_video_history_html(vid_id: str, snapshots: object, thumb_list: Set[str], thumbs_url: str, similar_thumbs: List[Tuple[str, int]] = None, history_url_format: str = None) -> str:
+	"""
+	Renders a html page listing all snapshots of a single video, newest first.
 
-			out_video += "\n<b>Title</b>: <a href=\"%s\">%s</a>" % (vid_url, vid_title)
+	@snapshots: dictionary mapping timestamp to video metadata
+	@similar_thumbs: list of tuple(video id, hash distance) of videos with similar thumbnail, to be linked
+	@history_url_format: format string of video snapshot history page url, with video id as its only argument
+	"""
+	out_html = "<!DOCTYPE html>\n<html>\n<head>\n<title>%s</title>\n</head>\n<body>\n" % vid_id
+	out_html += "<b>Video</b>: <a href=\"https://www.youtube.com/watch?v=%s\">%s</a>" % (vid_id, vid_id)
+	out_html += "<br />\n<b>Snapshots</b>: %d" % len(snapshots)
 
-			channel_url = None
-			if JSON_KEY_CHANNEL_ID in vid_meta:
-				channel_url = get_channel_url_from_id(vid_meta[JSON_KEY_CHANNEL_ID])
+	if similar_thumbs is not None and len(similar_thumbs) > 0:
+		out_html += "<br />\n<b>Similar thumbnails</b>: "
+		out_html += ", ".join(["<a href=\"%s\">%s</a> (%d)" % (history_url_format % other_id, other_id, distance) for other_id, distance in similar_thumbs])
 
-			# note: in the past yt used to have channel urls like "https://youtube.com/user/ChannelName",
-			# but it doesn't seem to work anymore. keep username in JSON_KEY_CHANNEL_USERNAME just in case
+	out_html += render_table_header()
+	for snapshot_timestamp in sorted([int(key) for key in snapshots.keys()], reverse=True):
+		out_html += render_video_row(vid_id, snapshots[str(snapshot_timestamp)], snapshot_timestamp, None, None, thumb_list, thumbs_url)
+	out_html += "</table>\n"
 
-			channel_name = None
-			if JSON_KEY_CHANNEL_NAME in vid_meta:
-				channel_name = sanitize_display_string(vid_meta[JSON_KEY_CHANNEL_NAME])
+	out_html += "</body>\n</html>\n"
 
-			if channel_url is not None and channel_name is not None:
-				out_video += "<br />\n<b>Channel</b>: <a href=\"%s\">%s</a>" % (channel_url, channel_name)
-			elif channel_url is None and channel_name is not None:
-				out_video += "<br />\n<b>Channel</b>: %s" % channel_name
-			elif channel_url is not None:
-				out_video += "<br />\n<b>Channel</b>: <a href=\"%s\">%s</a>" % (channel_url, UNKNOWN_NAME)
+	return out_html
 
-			if JSON_KEY_DURATION in vid_meta:
-				out_video += "<br />\n<b>Duration</b>: " + duration_to_timestring(vid_meta[JSON_KEY_DURATION])
 
-			if JSON_KEY_STATUS in vid_meta:
-				vid_status = vid_meta[JSON_KEY_STATUS]
+def render_dump_index_html(dump_name: str, dump: object, playlist_url_format: str) -> str:
+	"""
+	Renders a html page listing playlists contained in a dump.
 
-				if vid_status in KNOWN_STATUSES:
-					status_counts[vid_status] += 1
-				else:
-					status_counts[STATUS_UNSPEC] += 1
+	@playlist_url_format: format string of playlist page url, with playlist index in dump as its only argument
+	"""
+	out_html = "<!DOCTYPE html>\n<html>\n<head>\n<title>%s</title>\n</head>\n<body>\n" % dump_name
 
-				color = status_str_to_color(vid_status)
-				out_video += "<br />\n<b>Status</b>: <span style=\"color: %s;\">%s</span>" % (color, vid_status)
-			else:
-				status_counts[STATUS_UNSPEC] += 1
+	if JSON_KEY_DUMP_TIME in dump:
+		out_html += "<b>Dump time</b>: %s<br />\n" % timestamp_to_datestring(dump[JSON_KEY_DUMP_TIME])
 
-			out_video += "<br />\n<b>Thumbs</b>: "
-			out_video += "<a href=\"https://i.ytimg.com/vi/%s/default.jpg\">[1]</a> " % vid_id
-			out_video += "<a href=\"https://i.ytimg.com/vi/%s/mqdefault.jpg\">[2]</a> " % vid_id
-			out_video += "<a href=\"https://i.ytimg.com/vi/%s/hqdefault.jpg\">[3]</a> " % vid_id
-			out_video += "<a href=\"https://i.ytimg.com/vi/%s/sddefault.jpg\">[4]</a> " % vid_id
-			out_video += "<a href=\"https://i.ytimg.com/vi/%s/maxresdefault.jpg\">[5]</a> " % vid_id
+	out_html += "<ul>\n"
+	for i, playlist in enumerate(dump.get(JSON_KEY_PLAYLISTS, [])):
+		title = sanitize_display_string(playlist.get(JSON_KEY_TITLE, UNKNOWN_NAME))
+		out_html += "<li><a href=\"%s\">%s</a> (%d videos)</li>\n" % (playlist_url_format % i, title, len(playlist.get(JSON_KEY_VIDEOS, [])))
+	out_html += "</ul>\n"
 
-			if JSON_KEY_PUBLISHED in vid_meta:
-				out_video += "<br />\n<b>Published</b>: %s" % timestamp_to_datestring(vid_meta[JSON_KEY_PUBLISHED])
+	out_html += "</body>\n</html>\n"
 
-			if JSON_KEY_ADDED_TIME in video:
-				out_video += "<br />\n<b>Added to playlist</b>: %s" % timestamp_to_datestring(video[JSON_KEY_ADDED_TIME])
+	return out_html
 
-			if vid_meta_timestamp is not None:
-				out_video += "<br />\n<b>Snapshot taken</b>: %s" % timestamp_to_datestring(vid_meta_timestamp)
-				if vid_meta_timestamp == dump_time:
-					out_video += " (dump time)"
 
-			out_video += "\n</td><td>"
+def generate_html(db: object, dump: object, output_dir: str, thumbs_dir_path: str, thumb_list: Set[str] = None):
+	os.makedirs(output_dir, exist_ok=True)
 
-			# description
+	print("Writing to", output_dir)
 
-			if JSON_KEY_DESCRIPTION in vid_meta:
-				out_video += add_newlines(sanitize_display_string(vid_meta[JSON_KEY_DESCRIPTION]))
+	for required_key in [JSON_KEY_PLAYLISTS, JSON_KEY_DUMP_TIME]:
+		if required_key not in dump:
+			print("\"%s\" missing from dump, aborting" % required_key)
+			return
 
-			out_video += "</td></tr>"
-			out_table += out_video
+	if thumb_list is None:
+		thumb_list = get_thumb_list(thumbs_dir_path)
 
-		### end table ###
-		out_table += "</table>\n"
+	thumbs_url = "../../" + DIR_THUMBS
 
-		out_info += "<br />\n<b>Contents status</b>:"
-		for status, count in status_counts.items():
-			if count < 1:
-				continue
-			out_info += "<br />\n%s: %d" % (status, count)
+	for playlist in dump[JSON_KEY_PLAYLISTS]:
+		print("Processing", playlist.get(JSON_KEY_TITLE, UNKNOWN_NAME))
 
-		out_html += out_info
-		out_html += out_table
-		out_html += "</body>\n</html>\n"
+		out_html = render_playlist_html(db, playlist, dump[JSON_KEY_DUMP_TIME], thumb_list, thumbs_url)
+		if out_html is None:
+			continue
 
+		output_path = os.path.join(output_dir, sanitize_filename(playlist[JSON_KEY_TITLE]) + ".html")
 		with open(output_path, "w") as f:
 			f.write(out_html)
@@ -1,5 +1,7 @@
 import json
 
+VALUE_DELIMITERS = " \t\n\r,:}"
+
 
 def load_json(json_path: str) -> object:
 	try:
@@ -12,3 +14,81 @@ def load_json(json_path: str) -> object:
 def save_json(obj: object, json_path: str):
 	with open(json_path, "w") as f:
 		json.dump(obj, f, indent='\t')
+
+
+def iter_json_object_items(json_path: str, chunk_size: int = 1 << 20, object_pairs_hook=None):
+	"""
+	Yields (key, value) pairs of a json file containing a single top-level object, one pair at a time, without loading
+	the whole file into memory. Memory usage is bounded by the size of the largest value.
+	Raises json.JSONDecodeError if the file is malformed.
+
+	@object_pairs_hook: passed to json decoder, used to decode values
+	"""
+	decoder = json.JSONDecoder(object_pairs_hook=object_pairs_hook)
+
+	with open(json_path, "r") as f:
+		buf = ""
+		pos = 0
+		eof = False
+
+		def read_more(min_size: int) -> bool:
+			nonlocal buf, pos, eof
+			if eof:
+				return False
+			# drop already parsed part of the buffer
+			buf = buf[pos:]
+			pos = 0
+			chunk = f.read(max(chunk_size, min_size))
+			if len(chunk) == 0:
+				eof = True
+				return False
+			buf += chunk
+			return True
+
+		def skip_whitespace():
+			nonlocal pos
+			while True:
+				while pos < len(buf) and buf[pos] in " \t\n\r":
+					pos += 1
+				if pos < len(buf) or not read_more(0):
+					return
+
+		def expect(chars: str) -> str:
+			nonlocal pos
+			skip_whitespace()
+			if pos >= len(buf) or buf[pos] not in chars:
+				raise json.JSONDecodeError("Expected one of \"%s\"" % chars, buf, pos)
+			pos += 1
+			return buf[pos - 1]
+
+		def decode_value() -> object:
+			nonlocal pos
+			skip_whitespace()
+			while True:
+				try:
+					value, end = decoder.raw_decode(buf, pos)
+					# a value not followed by a delimiter might be incomplete, e.g. a number cut off by the end of buffer
+					# is decoded as its prefix ("1.5e10" as 1.5 if the buffer ends before "e")
+					if (end < len(buf) and buf[end] in VALUE_DELIMITERS) or eof:
+						pos = end
+						return value
+				except json.JSONDecodeError:
+					if eof:
+						raise
+				# grow the read size along with the value, so that long values are not reparsed too many times
+				read_more(len(buf) - pos)
+
+		expect("{")
+		skip_whitespace()
+		if pos < len(buf) and buf[pos] == "}":
+			return
+
+		while True:
+			key = decode_value()
+			if not isinstance(key, str):
+				raise json.JSONDecodeError("Expected string key", buf, pos)
+			expect(":")
+			yield key, decode_value()
+
+			if expect(",}") == "}":
+				return
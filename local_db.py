@@ -0,0 +1,255 @@
+import os
+import json
+import shutil
+from datetime import datetime
+from typing import Dict, Set, Tuple
+
+from consts import *
+from json_util import load_json, save_json, iter_json_object_items
+from util import get_file_title_from_path, datetime_to_timestring
+
+
+def get_db_journal_path(db_path: str) -> str:
+	return db_path + JOURNAL_SUFFIX
+
+
+def replay_db_journal(db: object, db_path: str):
+	"""
+	Applies database journal (see append_db_journal()) to the database, if it exists. Partially written lines
+	(e.g. after a crash) are ignored.
+	"""
+	journal_path = get_db_journal_path(db_path)
+	if not os.path.exists(journal_path):
+		return
+
+	entry_cnt = 0
+	for record in iter_db_journal_records(db_path):
+		apply_db_journal_record(db, record)
+		entry_cnt += 1
+
+	print("Replayed", entry_cnt, "database journal entries")
+
+
+def iter_db_journal_records(db_path: str):
+	"""
+	Yields records of database journal in order, see append_db_journal(). Partially written lines are skipped.
+	"""
+	journal_path = get_db_journal_path(db_path)
+	if not os.path.exists(journal_path):
+		return
+
+	with open(journal_path, "r") as f:
+		for line in f:
+			try:
+				record = json.loads(line)
+			except ValueError:
+				print("Ignoring incomplete database journal entry")
+				continue
+			if isinstance(record, list) and len(record) in (2, 3):
+				yield record
+
+
+def iter_local_db_items(db_path: str, object_pairs_hook=None):
+	"""
+	Yields (video id, snapshots) pairs of the database with database journal applied, streaming the database file
+	(see iter_json_object_items()), so that readers which don't load the whole database see the same data as
+	get_local_db(). Only the journal is kept in memory. Videos that are only in the journal are yielded last.
+	"""
+	journal_records = {}
+	for record in iter_db_journal_records(db_path):
+		journal_records.setdefault(record[0], []).append(record)
+
+	applied_ids = set()
+	if os.path.exists(db_path):
+		for vid_id, snapshots in iter_json_object_items(db_path, object_pairs_hook=object_pairs_hook):
+			if vid_id in journal_records:
+				applied_ids.add(vid_id)
+				entry = { vid_id: snapshots }
+				for record in journal_records[vid_id]:
+					apply_db_journal_record(entry, record)
+				snapshots = entry[vid_id]
+			yield vid_id, snapshots
+
+	for vid_id, records in journal_records.items():
+		if vid_id in applied_ids:
+			continue
+		entry = {}
+		for record in records:
+			apply_db_journal_record(entry, record)
+		if vid_id in entry:
+			yield vid_id, entry[vid_id]
+
+
+def apply_db_journal_record(db: object, record: list):
+	"""
+	Applies a single database journal record, see append_db_journal().
+	"""
+	if len(record) == 2:
+		vid_id, snapshots = record
+		db[vid_id] = snapshots
+	elif len(record) == 3:
+		vid_id, old_timestamp, new_timestamp = record
+		snapshots = db.get(vid_id)
+		if isinstance(snapshots, dict) and old_timestamp in snapshots:
+			# same as in update_db: the snapshot moves to the end
+			snapshots[new_timestamp] = snapshots.pop(old_timestamp)
+
+
+def append_db_journal(db: object, db_path: str, vid_ids: Set[str], bumped: Dict[str, Tuple[str, str]] = None):
+	"""
+	Persists selected database entries by appending them to database journal, instead of rewriting the whole
+	database. Each line is either the whole entry of one video (list [video id, snapshots]), or a timestamp bump of
+	one snapshot (list [video id, old timestamp, new timestamp]), so replaying the journal in order gives current
+	state. The journal is removed when the database is saved with save_local_db().
+
+	@vid_ids: ids of videos whose entries have changed
+	@bumped: dictionary mapping video id to tuple(old timestamp, new timestamp) of snapshots whose timestamp was only
+		bumped, see update_db()
+	"""
+	journal_path = get_db_journal_path(db_path)
+
+	# after a crash the last line might be incomplete, don't append to it
+	needs_newline = False
+	if os.path.exists(journal_path) and os.path.getsize(journal_path) > 0:
+		with open(journal_path, "rb") as f:
+			f.seek(-1, os.SEEK_END)
+			needs_newline = f.read(1) != b"\n"
+
+	with open(journal_path, "a") as f:
+		if needs_newline:
+			f.write("\n")
+		for vid_id in vid_ids:
+			f.write(json.dumps([vid_id, db[vid_id]]))
+			f.write("\n")
+		for vid_id, (old_timestamp, new_timestamp) in (bumped or {}).items():
+			f.write(json.dumps([vid_id, old_timestamp, new_timestamp]))
+			f.write("\n")
+		f.flush()
+		os.fsync(f.fileno())
+
+
+def is_db_journal_oversized(db_path: str) -> bool:
+	"""
+	Returns True if database journal has grown bigger than the database itself, i.e. it's time to compact it by
+	saving the whole database.
+	"""
+	journal_path = get_db_journal_path(db_path)
+	if not os.path.exists(journal_path):
+		return False
+	db_size = os.path.getsize(db_path) if os.path.exists(db_path) else 0
+	return os.path.getsize(journal_path) > db_size
+
+
+def get_local_db(db_path: str) -> object:
+	"""
+	If the database file does not exist, creates a database.
+	If the database file exists, loads it.
+	If database journal exists, it is applied to the database.
+	"""
+	db = load_json(db_path)
+	if db is None:
+		print("Cannot load local database, creating new one")
+		db = dict(DB_TEMPLATE)
+
+	replay_db_journal(db, db_path)
+
+	return db
+
+
+def save_local_db(db: object, db_path: str, backups_dir: str, no_backup: bool, datetime_now: datetime):
+	if not no_backup and os.path.exists(db_path):
+		db_name = get_file_title_from_path(db_path)
+		backup_filename = "%s_%s.json" % (db_name, datetime_to_timestring(datetime_now))
+		print("Backing up", db_name, "to", backup_filename)
+		os.makedirs(backups_dir, exist_ok=True)
+		backup_path = os.path.join(backups_dir, backup_filename)
+		shutil.move(db_path, backup_path)
+	save_json(db, db_path)
+
+	# database now contains everything from the journal
+	journal_path = get_db_journal_path(db_path)
+	if os.path.exists(journal_path):
+		os.unlink(journal_path)
+
+
+def can_overwrite_snapshot(existing_snapshot: object, new_snapshot: object) -> bool:
+	"""
+	Checks if a snapshot metadata object can be overwritten with a new one. This can happen if the new one contains the
+	same keys with the same values. It can also contain additional, new keys.
+	Assumptions: both are dictionaries containing non-array and non-object values.
+	"""
+	for key, value in existing_snapshot.items():
+		if key not in new_snapshot:
+			return False
+		elif new_snapshot[key] != existing_snapshot[key]:
+			return False
+
+	return True
+
+
+def update_db(db: object, dump: object, timestamp_now: int, changed_ids: Set[str] = None, bumped: Dict[str, Tuple[str, str]] = None) -> object:
+	"""
+	@changed_ids: if not None, ids of videos whose metadata was modified are added to it
+	@bumped: if not None, videos whose metadata is unchanged and only the timestamp of its snapshot was bumped are
+		added to it, mapping video id to tuple(old timestamp, new timestamp)
+	"""
+	# note: json keys are strings - use string keys in memory too, so that a database kept in memory between runs
+	# looks the same as one loaded from file
+	timestamp_key = str(timestamp_now)
+
+	for playlist in dump:
+		if JSON_KEY_VIDEOS not in playlist:
+			print("\"%s\" not found in playlist, skipping" % JSON_KEY_VIDEOS)
+			continue
+
+		for in_video in playlist[JSON_KEY_VIDEOS]:
+			if JSON_KEY_ID not in in_video:
+				print("\"%s\" not found in video, skipping" % JSON_KEY_ID)
+				continue
+
+			vid_id = in_video[JSON_KEY_ID]
+			del in_video[JSON_KEY_ID] # vid id is a key in db, it's not needed inside meta
+
+			if JSON_KEY_ADDED_TIME in in_video:
+				del in_video[JSON_KEY_ADDED_TIME] # added to playlist is stored in dumps, in playlists
+
+			if vid_id in db:
+				# at least one version of this video is already present in db
+				same_metadata_timestamp = None
+				insert_updated = True
+				for existing_video_timestamp, existing_video in db[vid_id].items():
+					if existing_video_timestamp == timestamp_key:
+						# we've already parsed this metadata in some other playlist during this run.
+						# it might happen that the metadata is actually different, but if it's from the same-ish time
+						# it doesn't really matter which one we take.
+						insert_updated = False
+						break
+
+					if can_overwrite_snapshot(existing_video, in_video):
+						same_metadata_timestamp = existing_video_timestamp
+						break
+
+				if insert_updated:
+					if same_metadata_timestamp is not None:
+						# one of the captures of metadata matches current capture - only bump its time
+						# (delete existing and add new with updated timestamp)
+						del db[vid_id][existing_video_timestamp]
+
+					# add the new metadata entry either way
+					db[vid_id][timestamp_key] = in_video
+
+					if same_metadata_timestamp is not None and existing_video == in_video:
+						if bumped is not None:
+							bumped[vid_id] = (same_metadata_timestamp, timestamp_key)
+					elif changed_ids is not None:
+						# new metadata, or matching metadata with new keys
+						changed_ids.add(vid_id)
+			else:
+				# video is not found in db - add it with current time
+				db[vid_id] = {
+					timestamp_key: in_video
+				}
+
+				if changed_ids is not None:
+					changed_ids.add(vid_id)
+	return db
@@ -0,0 +1,267 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Tuple
+
+from consts import *
+from html_gen import render_playlist_html, render_video_history_html, render_dump_index_html, sanitize_display_string
+from json_util import load_json
+from local_db import get_local_db, get_db_journal_path
+from thumb_hash import HammingIndex, load_thumb_hash_index
+from util import get_file_title_from_path, get_thumb_list
+
+URL_DUMPS = "/dumps/"
+URL_VIDEOS = "/videos/"
+URL_THUMBS = "/" + DIR_THUMBS
+
+THUMBS_MAX_AGE = 24 * 60 * 60 # seconds
+
+reg_dump_index_url = re.compile(r"^/dumps/([A-Za-z0-9_\-]+)/$")
+reg_playlist_url = re.compile(r"^/dumps/([A-Za-z0-9_\-]+)/([0-9]+)\.html$")
+reg_video_url = re.compile(r"^/videos/([A-Za-z0-9_\-]+)\.html$")
+reg_thumb_url = re.compile(r"^/" + DIR_THUMBS + r"/([A-Za-z0-9_\-]+\.jpg)$")
+
+
+class RenderedPageCache:
+	"""
+	Bounded LRU cache of rendered pages, mapping url path to tuple(page body, etag, state signature). State signature
+	identifies the version of the archive the page was rendered from (see ArchiveServer.refresh_state()), pages
+	rendered from a different version are ignored.
+	"""
+
+	def __init__(self, max_size: int):
+		self.max_size = max_size
+		self.pages = OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, path: str, signature: tuple) -> Tuple[bytes, str, tuple]:
+		with self.lock:
+			page = self.pages.get(path)
+			if page is None or page[2] != signature:
+				return None
+			self.pages.move_to_end(path)
+			return page
+
+	def put(self, path: str, body: bytes, signature: tuple) -> Tuple[bytes, str, tuple]:
+		page = (body, "\"%s\"" % hashlib.sha1(body).hexdigest(), signature)
+		with self.lock:
+			self.pages[path] = page
+			self.pages.move_to_end(path)
+			while len(self.pages) > self.max_size:
+				self.pages.popitem(last=False)
+		return page
+
+	def clear(self):
+		with self.lock:
+			self.pages.clear()
+
+
+class ArchiveServer(ThreadingHTTPServer):
+	"""
+	Serves the archive in root directory, rendering pages on request. Database, thumbnail list and thumbnail hash
+	index are reloaded, and rendered pages are dropped from cache, whenever the database file, dumps directory,
+	thumbnails directory or thumbnail hash index changes on disk.
+	"""
+
+	def __init__(self, address: Tuple[str, int], root_dir: str, cache_size: int, thumb_distance: int):
+		super().__init__(address, ArchiveRequestHandler)
+		self.root_dir = root_dir
+		self.db_path = os.path.join(root_dir, FILENAME_DB)
+		self.dumps_dir_path = os.path.join(root_dir, DIR_DUMPS)
+		self.thumbs_dir_path = os.path.join(root_dir, DIR_THUMBS)
+		self.thumb_hashes_path = os.path.join(root_dir, FILENAME_THUMB_HASHES)
+		self.thumb_distance = thumb_distance
+
+		self.cache = RenderedPageCache(cache_size)
+		self.state_lock = threading.Lock()
+		self.state_signature = None
+		self.db = None
+		self.thumb_list = None
+		self.thumb_index = None
+		self.state = None
+
+	def get_path_signature(self, path: str) -> Tuple[int, int]:
+		try:
+			stat = os.stat(path)
+		except FileNotFoundError:
+			return None
+		return stat.st_mtime_ns, stat.st_size
+
+	def refresh_state(self) -> tuple:
+		"""
+		Reloads database and thumbnail list and invalidates cache if anything has changed since last request.
+
+		@returns: current state as tuple(state signature, database, thumbnail list, thumbnail hash index). A request
+			should use only this tuple, so that the whole page is rendered from a single version of the archive, even
+			if another request reloads the state meanwhile.
+		"""
+		signature = tuple(self.get_path_signature(path) for path in (self.db_path, self.dumps_dir_path, self.thumbs_dir_path, self.thumb_hashes_path, get_db_journal_path(self.db_path)))
+
+		with self.state_lock:
+			if signature == self.state_signature:
+				return self.state
+
+			# database journal is appended to by a running daemon, see append_db_journal()
+			if self.state_signature is None or signature[0] != self.state_signature[0] or signature[4] != self.state_signature[4]:
+				print("Loading database")
+				self.db = get_local_db(self.db_path)
+
+			if self.state_signature is None or signature[2] != self.state_signature[2]:
+				self.thumb_list = get_thumb_list(self.thumbs_dir_path) if signature[2] is not None else set()
+
+			if self.state_signature is None or signature[3] != self.state_signature[3]:
+				self.thumb_index = HammingIndex(load_thumb_hash_index(self.root_dir), self.thumb_distance)
+
+			self.cache.clear()
+			self.state_signature = signature
+			self.state = (signature, self.db, self.thumb_list, self.thumb_index)
+
+			return self.state
+
+	def load_dump(self, dump_name: str) -> object:
+		return load_json(os.path.join(self.dumps_dir_path, dump_name + ".json"))
+
+	def render_root_index(self) -> str:
+		if os.path.isdir(self.dumps_dir_path):
+			dump_names = sorted([get_file_title_from_path(f) for f in os.listdir(self.dumps_dir_path) if f.endswith(".json")], reverse=True)
+		else:
+			dump_names = []
+
+		out_html = "<!DOCTYPE html>\n<html>\n<head>\n<title>Dumps</title>\n</head>\n<body>\n<ul>\n"
+		for dump_name in dump_names:
+			out_html += "<li><a href=\"%s%s/\">%s</a></li>\n" % (URL_DUMPS, dump_name, dump_name)
+		out_html += "</ul>\n</body>\n</html>\n"
+
+		return out_html
+
+	def render_page(self, path: str, state: tuple) -> str:
+		"""
+		@state: state returned by refresh_state()
+
+		@returns: html string, or None if there is no page at that path
+		"""
+		_, db, thumb_list, thumb_index = state
+
+		if path == "/":
+			return self.render_root_index()
+
+		match = reg_dump_index_url.match(path)
+		if match is not None:
+			dump = self.load_dump(match[1])
+			if dump is None:
+				return None
+			return render_dump_index_html(sanitize_display_string(match[1]), dump, "%d.html")
+
+		match = reg_playlist_url.match(path)
+		if match is not None:
+			dump = self.load_dump(match[1])
+			if dump is None or JSON_KEY_DUMP_TIME not in dump:
+				return None
+
+			playlists = dump.get(JSON_KEY_PLAYLISTS, [])
+			playlist_idx = int(match[2])
+			if playlist_idx >= len(playlists):
+				return None
+
+			return render_playlist_html(db, playlists[playlist_idx], dump[JSON_KEY_DUMP_TIME], thumb_list, "../.." + URL_THUMBS, "../.." + URL_VIDEOS + "%s.html")
+
+		match = reg_video_url.match(path)
+		if match is not None:
+			if match[1] not in db:
+				return None
+			similar_thumbs = thumb_index.find_similar(match[1])
+			return render_video_history_html(match[1], db[match[1]], thumb_list, ".." + URL_THUMBS, similar_thumbs, "%s.html")
+
+		return None
+
+
+class ArchiveRequestHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		path = self.path.split("?", 1)[0]
+
+		match = reg_thumb_url.match(path)
+		if match is not None:
+			self.send_thumb(os.path.join(self.server.thumbs_dir_path, match[1]))
+			return
+
+		state = self.server.refresh_state()
+		signature = state[0]
+
+		page = self.server.cache.get(path, signature)
+		if page is None:
+			out_html = self.server.render_page(path, state)
+			if out_html is None:
+				self.send_error(HTTPStatus.NOT_FOUND)
+				return
+			page = self.server.cache.put(path, out_html.encode(), signature)
+
+		body, etag, _ = page
+
+		# pages are cached by browsers, but have to be revalidated as they change along with the archive
+		if self.headers.get("If-None-Match") == etag:
+			self.send_response(HTTPStatus.NOT_MODIFIED)
+			self.send_header("ETag", etag)
+			self.end_headers()
+			return
+
+		self.send_response(HTTPStatus.OK)
+		self.send_header("Content-Type", "text/html; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.send_header("Cache-Control", "no-cache")
+		self.send_header("ETag", etag)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def send_thumb(self, thumb_path: str):
+		try:
+			stat = os.stat(thumb_path)
+		except FileNotFoundError:
+			self.send_error(HTTPStatus.NOT_FOUND)
+			return
+
+		etag = "\"%x-%x\"" % (stat.st_mtime_ns, stat.st_size)
+		last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+		if self.is_not_modified(etag, int(stat.st_mtime)):
+			self.send_response(HTTPStatus.NOT_MODIFIED)
+			self.send_header("ETag", etag)
+			self.end_headers()
+			return
+
+		with open(thumb_path, "rb") as f:
+			body = f.read()
+
+		self.send_response(HTTPStatus.OK)
+		self.send_header("Content-Type", "image/jpeg")
+		self.send_header("Content-Length", str(len(body)))
+		self.send_header("Cache-Control", "max-age=%d" % THUMBS_MAX_AGE)
+		self.send_header("ETag", etag)
+		self.send_header("Last-Modified", last_modified)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def is_not_modified(self, etag: str, mtime: int) -> bool:
+		if "If-None-Match" in self.headers:
+			return self.headers["If-None-Match"] == etag
+
+		if "If-Modified-Since" in self.headers:
+			try:
+				return mtime <= parsedate_to_datetime(self.headers["If-Modified-Since"]).timestamp()
+			except (TypeError, ValueError):
+				return False
+
+		return False
+
+
+def serve_archive(root_dir: str, bind: str, port: int, cache_size: int, thumb_distance: int):
+	with ArchiveServer((bind, port), root_dir, cache_size, thumb_distance) as server:
+		print("Serving %s on http://%s:%d/" % (root_dir, bind, port))
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
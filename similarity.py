@@ -0,0 +1,332 @@
+import os
+import re
+import json
+import hashlib
+from typing import Dict, List, Set, Tuple
+
+from consts import *
+from html_gen import is_snapshot_useful, describe_video
+from json_util import load_json, save_json
+
+SIGNATURE_BINS = 64
+BAND_COUNT = 16 # rows per band = SIGNATURE_BINS / BAND_COUNT
+BIN_VALUE_BITS = 32 # only this many lowest bits of each bin value are stored
+DESCRIPTION_SHINGLE_WORDS = 3
+MAX_BUCKET_SIZE = 200 # bigger buckets (e.g. generic titles) are skipped when building clusters
+
+SIMILARITY_KEY_SIGNATURES = "signatures"
+SIMILARITY_KEY_BUCKETS = "buckets"
+
+BIN_HEX_LEN = BIN_VALUE_BITS // 4
+BAND_HEX_LEN = SIGNATURE_BINS // BAND_COUNT * BIN_HEX_LEN
+BIN_VALUE_MASK = (1 << BIN_VALUE_BITS) - 1
+
+reg_words = re.compile(r"\w+")
+
+
+def get_shingles(snapshot: object) -> Set[str]:
+	"""
+	Title is split into single words, as reuploads often change titles only slightly (e.g. add "[reupload]").
+	Description is split into overlapping word n-grams, so that word order matters for longer texts.
+	"""
+	shingles = set()
+
+	title_words = reg_words.findall(snapshot.get(JSON_KEY_TITLE, "").lower())
+	shingles.update(["t:" + word for word in title_words])
+
+	description_words = reg_words.findall(snapshot.get(JSON_KEY_DESCRIPTION, "").lower())
+	for i in range(len(description_words) - DESCRIPTION_SHINGLE_WORDS + 1):
+		shingles.add("d:" + " ".join(description_words[i:i + DESCRIPTION_SHINGLE_WORDS]))
+
+	return shingles
+
+
+def hash_shingle(shingle: str) -> int:
+	return int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "little")
+
+
+def compute_signature(shingles: Set[str]) -> str:
+	"""
+	Computes MinHash signature using one permutation hashing: each shingle is hashed once, the hash selects a bin
+	and the rest of it is the value. Each bin keeps its minimum value. Empty bins are filled from the nearest
+	non-empty bin to the right (densification), so that the signature can be banded. Probability of two signatures
+	having equal value in a bin approximates Jaccard similarity of shingle sets.
+
+	@returns: signature as hex string, BIN_HEX_LEN characters per bin, or None if there are no shingles
+	"""
+	if len(shingles) == 0:
+		return None
+
+	bins = [None] * SIGNATURE_BINS
+	for shingle in shingles:
+		shingle_hash = hash_shingle(shingle)
+		bin_idx = shingle_hash % SIGNATURE_BINS
+		value = (shingle_hash // SIGNATURE_BINS) & BIN_VALUE_MASK
+		if bins[bin_idx] is None or value < bins[bin_idx]:
+			bins[bin_idx] = value
+
+	signature = []
+	for bin_idx in range(SIGNATURE_BINS):
+		distance = 0
+		while bins[(bin_idx + distance) % SIGNATURE_BINS] is None:
+			distance += 1
+		# borrowed values are offset by distance, so they don't collide with real values of other bins
+		signature.append((bins[(bin_idx + distance) % SIGNATURE_BINS] + distance * 0x9E3779B1) & BIN_VALUE_MASK)
+
+	return "".join(["%0*x" % (BIN_HEX_LEN, value) for value in signature])
+
+
+def estimate_similarity(signature_a: str, signature_b: str) -> float:
+	equal_cnt = 0
+	for i in range(0, len(signature_a), BIN_HEX_LEN):
+		if signature_a[i:i + BIN_HEX_LEN] == signature_b[i:i + BIN_HEX_LEN]:
+			equal_cnt += 1
+	return equal_cnt / SIGNATURE_BINS
+
+
+def get_content_hash(snapshot: object) -> str:
+	"""
+	Hashes the part of a snapshot that signature is computed from. Snapshot timestamps are bumped by each dump that
+	finds the same metadata (see update_db()), so signatures are keyed by content instead.
+	"""
+	content = json.dumps([snapshot.get(JSON_KEY_TITLE, ""), snapshot.get(JSON_KEY_DESCRIPTION, "")])
+	return hashlib.blake2b(content.encode(), digest_size=8).hexdigest()
+
+
+class SimilarityIndex:
+	"""
+	LSH index over MinHash signatures: each signature is split into BAND_COUNT bands, and videos are put into buckets
+	by the exact content of each band. Only videos sharing at least one bucket are compared, so a query doesn't have
+	to go through the whole archive. Both signatures and buckets are stored in FILENAME_SIMILARITY_INDEX and updated
+	in place, see update_similarity_index().
+	"""
+
+	def __init__(self, signatures: Dict[str, Dict[str, str]], buckets: Dict[str, Set[str]] = None):
+		"""
+		@signatures: dictionary mapping video id to dictionary mapping content hash (see get_content_hash()) to
+			signature
+		@buckets: dictionary mapping band key to set of video ids, built from signatures if None
+		"""
+		if buckets is not None:
+			self.signatures = signatures
+			self.buckets = buckets
+			return
+
+		self.signatures = {}
+		self.buckets = {}
+		for vid_id, vid_signatures in signatures.items():
+			self.set_video_signatures(vid_id, vid_signatures)
+
+	def get_band_keys(self, signature: str) -> List[str]:
+		# json keys are strings, band index is a part of the key
+		return ["%x:%s" % (band_idx, signature[band_idx * BAND_HEX_LEN:(band_idx + 1) * BAND_HEX_LEN]) for band_idx in range(BAND_COUNT)]
+
+	def get_video_band_keys(self, vid_id: str) -> Set[str]:
+		return { band_key for signature in self.signatures.get(vid_id, {}).values() for band_key in self.get_band_keys(signature) }
+
+	def set_video_signatures(self, vid_id: str, vid_signatures: Dict[str, str]):
+		"""
+		Replaces signatures of a video and moves it to buckets of new signatures. Empty vid_signatures removes the video.
+		"""
+		old_band_keys = self.get_video_band_keys(vid_id)
+
+		if len(vid_signatures) > 0:
+			self.signatures[vid_id] = vid_signatures
+		elif vid_id in self.signatures:
+			del self.signatures[vid_id]
+
+		new_band_keys = self.get_video_band_keys(vid_id)
+
+		for band_key in old_band_keys - new_band_keys:
+			bucket = self.buckets[band_key]
+			bucket.discard(vid_id)
+			if len(bucket) == 0:
+				del self.buckets[band_key]
+
+		for band_key in new_band_keys - old_band_keys:
+			self.buckets.setdefault(band_key, set()).add(vid_id)
+
+	def get_similarity(self, vid_id_a: str, vid_id_b: str) -> float:
+		"""
+		@returns: highest estimated similarity between any snapshots of two videos
+		"""
+		return max([estimate_similarity(signature_a, signature_b) for signature_a in self.signatures[vid_id_a].values() for signature_b in self.signatures[vid_id_b].values()])
+
+	def find_similar(self, vid_id: str, threshold: float) -> List[Tuple[str, float]]:
+		"""
+		@returns: list of tuple(video id, estimated similarity) of other videos with similarity of at least threshold,
+			most similar first
+		"""
+		if vid_id not in self.signatures:
+			return []
+
+		candidates = set()
+		for signature in self.signatures[vid_id].values():
+			for band_key in self.get_band_keys(signature):
+				candidates.update(self.buckets.get(band_key, set()))
+		candidates.discard(vid_id)
+
+		out = []
+		for other_id in candidates:
+			similarity = self.get_similarity(vid_id, other_id)
+			if similarity >= threshold:
+				out.append((other_id, similarity))
+
+		return sorted(out, key=lambda k: k[1], reverse=True)
+
+	def find_clusters(self, threshold: float) -> List[List[str]]:
+		"""
+		Groups videos with similar metadata. Similarity is transitive here, i.e. a cluster contains all videos connected
+		by a chain of similar videos.
+
+		@returns: list of clusters (lists of video ids) containing more than one video
+		"""
+		parent = {}
+
+		def find(vid_id: str) -> str:
+			while parent.get(vid_id, vid_id) != vid_id:
+				parent[vid_id] = parent.get(parent[vid_id], parent[vid_id])
+				vid_id = parent[vid_id]
+			return vid_id
+
+		compared = set()
+		for bucket in self.buckets.values():
+			if len(bucket) < 2 or len(bucket) > MAX_BUCKET_SIZE:
+				continue
+
+			bucket = sorted(bucket)
+			for i, vid_id_a in enumerate(bucket):
+				for vid_id_b in bucket[i + 1:]:
+					if (vid_id_a, vid_id_b) in compared:
+						continue
+					compared.add((vid_id_a, vid_id_b))
+
+					if self.get_similarity(vid_id_a, vid_id_b) < threshold:
+						continue
+
+					root_a, root_b = find(vid_id_a), find(vid_id_b)
+					if root_a != root_b:
+						parent[root_a] = root_b
+						parent.setdefault(root_b, root_b)
+
+		clusters = {}
+		for vid_id in parent:
+			clusters.setdefault(find(vid_id), []).append(vid_id)
+
+		return [sorted(cluster) for cluster in clusters.values()]
+
+
+def load_similarity_index(root_dir: str) -> SimilarityIndex:
+	"""
+	Loads persistent similarity index without updating it.
+
+	@returns: index, or None if there is no index (or it was saved by an older version)
+	"""
+	stored_index = load_json(os.path.join(root_dir, FILENAME_SIMILARITY_INDEX))
+	if stored_index is None or SIMILARITY_KEY_SIGNATURES not in stored_index or SIMILARITY_KEY_BUCKETS not in stored_index:
+		return None
+
+	buckets = { band_key: set(vid_ids) for band_key, vid_ids in stored_index[SIMILARITY_KEY_BUCKETS].items() }
+	return SimilarityIndex(stored_index[SIMILARITY_KEY_SIGNATURES], buckets)
+
+
+def update_similarity_index(db: object, root_dir: str, vid_ids: Set[str] = None) -> SimilarityIndex:
+	"""
+	Loads persistent similarity index, updates signatures of selected videos and saves the index. Signatures are
+	computed only for title and description that are not in the index yet, signatures of content that is no longer
+	in the database are dropped.
+
+	@vid_ids: ids of videos to update (e.g. changed by a dump), all videos in database or index if None. All videos are
+		updated anyway if there is no index yet.
+	"""
+	index_path = os.path.join(root_dir, FILENAME_SIMILARITY_INDEX)
+
+	index = load_similarity_index(root_dir)
+	if index is None:
+		index = SimilarityIndex({})
+		vid_ids = None
+
+	if vid_ids is None:
+		vid_ids = set(db.keys()) | set(index.signatures.keys())
+
+	added_cnt = 0
+	removed_cnt = 0
+
+	for vid_id in vid_ids:
+		old_signatures = index.signatures.get(vid_id, {})
+		new_signatures = {}
+
+		for snapshot in db.get(vid_id, {}).values():
+			if not is_snapshot_useful(snapshot.get(JSON_KEY_STATUS)):
+				continue
+
+			content_hash = get_content_hash(snapshot)
+			if content_hash in new_signatures:
+				continue
+
+			signature = old_signatures.get(content_hash)
+			if signature is None:
+				signature = compute_signature(get_shingles(snapshot))
+				if signature is None:
+					continue
+				added_cnt += 1
+
+			new_signatures[content_hash] = signature
+
+		removed_hashes = [content_hash for content_hash in old_signatures if content_hash not in new_signatures]
+		if len(removed_hashes) > 0 or len(new_signatures) != len(old_signatures):
+			removed_cnt += len(removed_hashes)
+			index.set_video_signatures(vid_id, new_signatures)
+
+	if added_cnt > 0 or removed_cnt > 0 or not os.path.exists(index_path):
+		print("Similarity index: %d signatures added, %d removed" % (added_cnt, removed_cnt))
+		save_json({
+			SIMILARITY_KEY_SIGNATURES: index.signatures,
+			SIMILARITY_KEY_BUCKETS: { band_key: sorted(bucket) for band_key, bucket in index.buckets.items() },
+		}, index_path)
+
+	return index
+
+
+def report_similar_videos(db: object, root_dir: str, vid_id: str, threshold: float):
+	"""
+	Prints videos with metadata similar to selected video, e.g. reuploads of a deleted video. The index is kept
+	current by run_dump(), only the selected video is updated here (or the whole index built, if there is none).
+	"""
+	if vid_id not in db:
+		print("Cannot find in database:", vid_id)
+		return
+
+	index = update_similarity_index(db, root_dir, { vid_id })
+	if vid_id not in index.signatures:
+		print("No snapshot of %s contains title or description" % vid_id)
+		return
+
+	# index might refer to videos removed from database since it was updated, e.g. by fsck
+	similar = [(other_id, similarity) for other_id, similarity in index.find_similar(vid_id, threshold) if other_id in db]
+
+	print("https://www.youtube.com/watch?v=%s %s" % (vid_id, describe_video(db[vid_id])))
+	for other_id, similarity in similar:
+		print("  %.2f https://www.youtube.com/watch?v=%s %s" % (similarity, other_id, describe_video(db[other_id])))
+
+	print("Found", len(similar), "similar videos")
+
+
+def report_duplicate_clusters(db: object, root_dir: str, threshold: float):
+	"""
+	Prints clusters of videos with similar metadata across the whole archive. The index is kept current by
+	run_dump(), it's built here only if there is none.
+	"""
+	index = load_similarity_index(root_dir)
+	if index is None:
+		index = update_similarity_index(db, root_dir)
+
+	clusters = [[vid_id for vid_id in cluster if vid_id in db] for cluster in index.find_clusters(threshold)]
+	clusters = [cluster for cluster in clusters if len(cluster) > 1]
+
+	for i, cluster in enumerate(clusters):
+		print("Cluster %d:" % (i + 1))
+		for vid_id in cluster:
+			print("  https://www.youtube.com/watch?v=%s %s" % (vid_id, describe_video(db[vid_id])))
+
+	print("Found", len(clusters), "clusters of videos with similar metadata")
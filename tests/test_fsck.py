@@ -0,0 +1,144 @@
+import io
+import os
+import sys
+import json
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from consts import *
+from fsck import *
+
+
+class CheckVideoTest(unittest.TestCase):
+	def check(self, snapshots: object) -> tuple:
+		report = FsckReport()
+		quarantined = {}
+		return check_video("v", snapshots, report, quarantined), report.counts, quarantined
+
+	def test_valid_entry_is_unchanged(self):
+		snapshots = { "100": { "status": "public", "title": "a" }, "200": { "status": "private" } }
+		repaired, counts, quarantined = self.check(snapshots)
+		self.assertEqual(repaired, snapshots)
+		self.assertEqual(len(counts), 0)
+		self.assertEqual(quarantined, {})
+
+	def test_normalizes_keys_and_status(self):
+		repaired, counts, _ = self.check({ "0200": { "title": "b" }, "100": { "status": "public", "title": "a" } })
+		self.assertEqual(repaired, { "100": { "status": "public", "title": "a" }, "200": { "title": "b", "status": STATUS_UNSPEC } })
+		self.assertEqual(list(repaired.keys()), ["100", "200"])
+		self.assertEqual(counts[PROBLEM_UNNORMALIZED_TIMESTAMP], 1)
+		self.assertEqual(counts[PROBLEM_MISSING_STATUS], 1)
+
+	def test_merges_colliding_snapshots(self):
+		# the snapshot that contains the other one is kept, regardless of order
+		for snapshots in (
+			{ "100": { "status": "public" }, "0100": { "status": "public", "title": "a" } },
+			{ "0100": { "status": "public", "title": "a" }, "100": { "status": "public" } },
+		):
+			with self.subTest(snapshots=snapshots):
+				repaired, counts, quarantined = self.check(snapshots)
+				self.assertEqual(repaired, { "100": { "status": "public", "title": "a" } })
+				self.assertEqual(counts[PROBLEM_TIMESTAMP_COLLISION], 1)
+				self.assertEqual(quarantined, {})
+
+	def test_quarantines_conflicting_snapshot(self):
+		repaired, counts, quarantined = self.check({ "100": { "status": "public", "title": "a" }, "0100": { "status": "public", "title": "b" } })
+		self.assertEqual(repaired, { "100": { "status": "public", "title": "a" } })
+		self.assertEqual(counts[PROBLEM_CONFLICTING_SNAPSHOT], 1)
+		self.assertEqual(quarantined, { "v": [{ "0100": { "status": "public", "title": "b" } }] })
+
+	def test_merges_duplicate_keys(self):
+		snapshots = DuplicateKeysObject([("100", { "status": "public", "title": "a" }), ("100", { "status": "public", "title": "b" })])
+		repaired, _, quarantined = self.check(snapshots)
+		self.assertEqual(repaired, { "100": { "status": "public", "title": "a" } })
+		self.assertEqual(quarantined, { "v": [{ "100": { "status": "public", "title": "b" } }] })
+
+	def test_removes_redundant_snapshot(self):
+		repaired, counts, _ = self.check({ "100": { "status": "public", "title": "a" }, "200": { "status": "public", "title": "a", "duration": 5 } })
+		self.assertEqual(repaired, { "200": { "status": "public", "title": "a", "duration": 5 } })
+		self.assertEqual(counts[PROBLEM_DUPLICATE_SNAPSHOT], 1)
+
+	def test_broken_entry(self):
+		for snapshots in ({}, [], { "100": 5 }, { "abc": { "status": "public" } }):
+			with self.subTest(snapshots=snapshots):
+				repaired, counts, _ = self.check(snapshots)
+				self.assertIsNone(repaired)
+				self.assertGreater(sum(counts.values()), 0)
+
+
+class CheckDbTest(unittest.TestCase):
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.root_dir = self.tmp_dir.name
+		self.db_path = os.path.join(self.root_dir, FILENAME_DB)
+		self.quarantine_dir = os.path.join(self.root_dir, DIR_QUARANTINE)
+
+	def tearDown(self):
+		self.tmp_dir.cleanup()
+
+	def write_db(self, text: str):
+		with open(self.db_path, "w") as f:
+			f.write(text)
+
+	def test_scan_db_round_trip(self):
+		self.write_db('{"v1": {"0100": {"status": "unlisted"}}, "v2": {"100": {"status": "private"}}, "v1": {"200": {"status": "public", "title": "a"}}}')
+
+		f_out = io.StringIO()
+		quarantined = {}
+		vid_ids, duplicated_ids, modified = scan_db(self.db_path, FsckReport(), f_out, quarantined, { "v1" })
+
+		self.assertEqual(vid_ids, { "v1", "v2" })
+		self.assertEqual(duplicated_ids, { "v1" })
+		self.assertTrue(modified)
+		self.assertEqual(quarantined, {})
+		self.assertEqual(json.loads(f_out.getvalue()), {
+			"v1": { "100": { "status": "unlisted" }, "200": { "status": "public", "title": "a" } },
+			"v2": { "100": { "status": "private" } },
+		})
+
+	def test_repair_merges_duplicate_entries(self):
+		self.write_db('{\n"v1": {"100": {"status": "public", "title": "a"}},\n"v2": 5,\n"v3": {"100": {"status": "public"}, "100": {"status": "private"}},\n'
+			'"v1": {"200": {"status": "public", "title": "b"}, "100": {"status": "public", "title": "a", "duration": 5}},\n"v4": {"300": {"status": "public"}}\n}')
+
+		report = FsckReport()
+		vid_ids = check_db(self.root_dir, report, True, self.quarantine_dir, datetime(2020, 1, 2, 3, 4, 5))
+
+		self.assertEqual(vid_ids, { "v1", "v3", "v4" })
+		self.assertEqual(report.counts[PROBLEM_DUPLICATE_KEY], 2)
+
+		with open(self.db_path, "r") as f:
+			db = json.load(f)
+		self.assertEqual(db, {
+			"v1": { "100": { "status": "public", "title": "a", "duration": 5 }, "200": { "status": "public", "title": "b" } },
+			"v3": { "100": { "status": "public" } },
+			"v4": { "300": { "status": "public" } },
+		})
+
+		# nothing is lost: dropped values are in quarantine, original database in backups
+		with open(os.path.join(self.quarantine_dir, FILENAME_DB), "r") as f:
+			self.assertEqual(json.load(f), { "v2": [5], "v3": [{ "100": { "status": "private" } }] })
+		self.assertTrue(os.path.exists(os.path.join(self.root_dir, DIR_BACKUPS, "db_2020-01-02_03-04-05.json")))
+
+		# repaired database has no problems left
+		report = FsckReport()
+		check_db(self.root_dir, report, True, self.quarantine_dir, datetime(2020, 1, 2, 3, 4, 6))
+		self.assertEqual(len(report.counts), 0)
+
+	def test_unmodified_database_is_not_rewritten(self):
+		self.write_db('{"v1": {"100": {"status": "public"}}}')
+		mtime = os.stat(self.db_path).st_mtime_ns
+
+		report = FsckReport()
+		check_db(self.root_dir, report, True, self.quarantine_dir, datetime.now())
+
+		self.assertEqual(len(report.counts), 0)
+		self.assertEqual(os.stat(self.db_path).st_mtime_ns, mtime)
+		self.assertFalse(os.path.exists(self.db_path + ".tmp"))
+		self.assertFalse(os.path.exists(self.quarantine_dir))
+
+
+if __name__ == "__main__":
+	unittest.main()
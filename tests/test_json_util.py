@@ -0,0 +1,45 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_util import iter_json_object_items
+
+
+class IterJsonObjectItemsTest(unittest.TestCase):
+	def iter_items(self, text: str, chunk_size: int) -> list:
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			json_path = os.path.join(tmp_dir, "test.json")
+			with open(json_path, "w") as f:
+				f.write(text)
+			return list(iter_json_object_items(json_path, chunk_size))
+
+	def test_matches_json_load(self):
+		texts = [
+			"{}",
+			"{\"a\": 1.5e10, \"b\": 2}",
+			"{\"a\":-12.25E-3,\"b\":true,\"c\":null}",
+			"{\n\t\"a\": 100,\n\t\"b\": [1, 22, 333],\n\t\"c\": {\"d\": \"e f\"}\n}\n",
+		]
+		for text in texts:
+			for chunk_size in range(1, len(text) + 2):
+				with self.subTest(text=text, chunk_size=chunk_size):
+					self.assertEqual(self.iter_items(text, chunk_size), list(json.loads(text).items()))
+
+	def test_number_split_across_chunks(self):
+		for chunk_size in (1, 4, 5, 8, 10):
+			with self.subTest(chunk_size=chunk_size):
+				self.assertEqual(self.iter_items("{\"a\": 1.5e10, \"b\": 2}", chunk_size), [("a", 1.5e10), ("b", 2)])
+
+	def test_malformed(self):
+		for text in ("{\"a\": 1.5x}", "{\"a\": 1", "{\"a\" 1}", "[1]"):
+			with self.subTest(text=text):
+				with self.assertRaises(json.JSONDecodeError):
+					self.iter_items(text, 4)
+
+
+if __name__ == "__main__":
+	unittest.main()
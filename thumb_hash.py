@@ -0,0 +1,192 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from consts import *
+from html_gen import describe_videos
+from json_util import load_json, save_json
+from util import get_file_title_from_path
+
+HASH_SIZE = 8 # hash is HASH_SIZE * HASH_SIZE bits
+HASH_BITS = HASH_SIZE * HASH_SIZE
+HASH_CHUNKSIZE = 32 # files per process pool task
+
+
+def is_hashing_available() -> bool:
+	try:
+		import PIL.Image
+	except ImportError:
+		return False
+	return True
+
+
+def hamming_distance(hash_a: int, hash_b: int) -> int:
+	return bin(hash_a ^ hash_b).count("1")
+
+
+def compute_dhash(image_path: str) -> int:
+	"""
+	Computes difference hash of an image: the image is scaled down to (HASH_SIZE + 1) x HASH_SIZE grayscale pixels,
+	and each bit tells whether a pixel is brighter than its right neighbour. Similar images have hashes with small
+	hamming distance, regardless of resolution and compression.
+
+	@returns: hash, or None if the image cannot be read
+	"""
+	import PIL.Image
+
+	try:
+		with PIL.Image.open(image_path) as image:
+			pixels = list(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), PIL.Image.LANCZOS).getdata())
+	except (OSError, ValueError):
+		return None
+
+	out_hash = 0
+	for row in range(HASH_SIZE):
+		for col in range(HASH_SIZE):
+			left = pixels[row * (HASH_SIZE + 1) + col]
+			right = pixels[row * (HASH_SIZE + 1) + col + 1]
+			out_hash = (out_hash << 1) | (left > right)
+
+	return out_hash
+
+
+def load_thumb_hash_index(root_dir: str) -> Dict[str, int]:
+	"""
+	Loads persistent thumbnail hash index without updating it.
+
+	@returns: dictionary mapping video id to thumbnail hash (or None if the thumbnail could not be read)
+	"""
+	stored_index = load_json(os.path.join(root_dir, FILENAME_THUMB_HASHES))
+	if stored_index is None:
+		return {}
+
+	# json can't hold 64-bit ints reliably, hashes are stored as hex strings
+	return { vid_id: int(hash_str, 16) if hash_str is not None else None for vid_id, hash_str in stored_index.items() }
+
+
+def update_thumb_hash_index(root_dir: str) -> Dict[str, int]:
+	"""
+	Loads persistent thumbnail hash index, computes hashes of thumbnails that are not in the index yet (in a process
+	pool), drops hashes of thumbnails that no longer exist, and saves the index.
+	Note: thumbnails are never redownloaded, so a file that is already in the index doesn't have to be hashed again.
+
+	@returns: dictionary mapping video id to thumbnail hash (or None if the thumbnail could not be read)
+	"""
+	thumbs_dir_path = os.path.join(root_dir, DIR_THUMBS)
+	index_path = os.path.join(root_dir, FILENAME_THUMB_HASHES)
+
+	stored_index = load_thumb_hash_index(root_dir)
+	thumb_filenames = { get_file_title_from_path(f): f for f in os.listdir(thumbs_dir_path) } if os.path.isdir(thumbs_dir_path) else {}
+
+	index = { vid_id: thumb_hash for vid_id, thumb_hash in stored_index.items() if vid_id in thumb_filenames }
+	removed_cnt = len(stored_index) - len(index)
+
+	new_vid_ids = [vid_id for vid_id in thumb_filenames if vid_id not in index]
+	if len(new_vid_ids) > 0:
+		print("Hashing", len(new_vid_ids), "new thumbnails")
+		new_paths = [os.path.join(thumbs_dir_path, thumb_filenames[vid_id]) for vid_id in new_vid_ids]
+		with ProcessPoolExecutor() as executor:
+			for vid_id, thumb_hash in zip(new_vid_ids, executor.map(compute_dhash, new_paths, chunksize=HASH_CHUNKSIZE)):
+				if thumb_hash is None:
+					print("Cannot read thumbnail", thumb_filenames[vid_id])
+				index[vid_id] = thumb_hash
+
+	if len(new_vid_ids) > 0 or removed_cnt > 0:
+		save_json({ vid_id: "%016x" % thumb_hash if thumb_hash is not None else None for vid_id, thumb_hash in index.items() }, index_path)
+
+	return index
+
+
+class HammingIndex:
+	"""
+	Multi-index hashing: hashes are split into max_distance + 1 chunks and each chunk is indexed in a separate table.
+	If two hashes differ in at most max_distance bits, by pigeonhole principle at least one of their chunks is equal,
+	so only hashes sharing a chunk have to be compared, instead of all of them.
+	"""
+
+	def __init__(self, hashes: Dict[str, int], max_distance: int):
+		self.max_distance = max_distance
+		self.hashes = {}
+
+		chunk_cnt = min(max_distance + 1, HASH_BITS)
+		bounds = [HASH_BITS * i // chunk_cnt for i in range(chunk_cnt + 1)]
+		self.chunks = [(low, (1 << (high - low)) - 1) for low, high in zip(bounds, bounds[1:])]
+		self.tables = [{} for _ in self.chunks]
+
+		for vid_id, thumb_hash in hashes.items():
+			# uniform (e.g. black) images all hash to 0 and don't tell anything about the video
+			if thumb_hash is None or thumb_hash == 0:
+				continue
+
+			self.hashes[vid_id] = thumb_hash
+			for (shift, mask), table in zip(self.chunks, self.tables):
+				table.setdefault((thumb_hash >> shift) & mask, []).append(vid_id)
+
+	def query(self, thumb_hash: int) -> List[Tuple[str, int]]:
+		"""
+		@returns: list of tuple(video id, distance) of hashes within max_distance of thumb_hash, closest first
+		"""
+		candidates = set()
+		for (shift, mask), table in zip(self.chunks, self.tables):
+			candidates.update(table.get((thumb_hash >> shift) & mask, []))
+
+		out = []
+		for vid_id in candidates:
+			distance = hamming_distance(thumb_hash, self.hashes[vid_id])
+			if distance <= self.max_distance:
+				out.append((vid_id, distance))
+
+		return sorted(out, key=lambda k: k[1])
+
+	def find_similar(self, vid_id: str) -> List[Tuple[str, int]]:
+		"""
+		@returns: list of tuple(video id, distance) of other videos with similar thumbnail, closest first
+		"""
+		if vid_id not in self.hashes:
+			return []
+		return [match for match in self.query(self.hashes[vid_id]) if match[0] != vid_id]
+
+	def find_groups(self) -> List[List[str]]:
+		"""
+		Groups videos with similar thumbnails. Similarity is transitive here, i.e. a group contains all videos connected
+		by a chain of similar thumbnails.
+
+		@returns: list of groups (lists of video ids) containing more than one video
+		"""
+		parent = {}
+
+		def find(vid_id: str) -> str:
+			while parent.get(vid_id, vid_id) != vid_id:
+				parent[vid_id] = parent.get(parent[vid_id], parent[vid_id])
+				vid_id = parent[vid_id]
+			return vid_id
+
+		for vid_id in self.hashes:
+			for other_id, _ in self.find_similar(vid_id):
+				root_a, root_b = find(vid_id), find(other_id)
+				if root_a != root_b:
+					parent[root_a] = root_b
+					parent.setdefault(root_b, root_b)
+
+		groups = {}
+		for vid_id in parent:
+			groups.setdefault(find(vid_id), []).append(vid_id)
+
+		return [sorted(group) for group in groups.values()]
+
+
+def report_thumb_duplicates(root_dir: str, max_distance: int):
+	"""
+	Updates thumbnail hash index and prints groups of videos with near-duplicate thumbnails.
+	"""
+	index = HammingIndex(update_thumb_hash_index(root_dir), max_distance)
+	groups = index.find_groups()
+
+	descriptions = describe_videos(os.path.join(root_dir, FILENAME_DB), { vid_id for group in groups for vid_id in group })
+
+	for i, group in enumerate(groups):
+		print("Group %d:" % (i + 1))
+		for vid_id in group:
+			print("  https://www.youtube.com/watch?v=%s %s" % (vid_id, descriptions.get(vid_id, "(not in database)")))
+
+	print("Found", len(groups), "groups of videos with similar thumbnails")
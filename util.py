@@ -1,7 +1,7 @@
 import os
 import re
 import pathlib
-from typing import List
+from typing import Set
 from datetime import datetime
 
 
@@ -16,11 +16,11 @@ def sanitize_filename(title: str) -> str:
 	return reg_sanitize.sub("_", title)
 
 
-def get_thumb_list(thumb_dir: str) -> List[str]:
+def get_thumb_list(thumb_dir: str) -> Set[str]:
 	"""
-	Returns a list of video ids that have a thumbnail downloaded.
+	Returns a set of video ids that have a thumbnail downloaded.
 	"""
-	return [get_file_title_from_path(f) for f in os.listdir(thumb_dir)]
+	return {get_file_title_from_path(f) for f in os.listdir(thumb_dir)}
 
 
 def datetime_to_timestring(date_time: datetime) -> str:
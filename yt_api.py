@@ -1,17 +1,19 @@
 import os
 import re
 import copy
-import requests
-from typing import List
+from typing import List, Dict, Set
 from datetime import datetime
-import google_auth_oauthlib.flow
-import googleapiclient.discovery
 
 from consts import *
+from json_util import load_json, save_json
 from util import get_thumb_list, datetime_to_timestamp
 
+# note: google api client libraries and requests are imported only where they are used, as importing them takes
+# a significant amount of time, which would slow down startup of commands that don't need the API (e.g. --html)
+
 CLIENT_SECRETS_FILE = "secret.json"
 SCOPES = ["https://www.googleapis.com/auth/youtube.readonly"]
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/youtube/v3/rest"
 MAX_LIST_RESULTS = 50 # more is not allowed by the API
 
 API_KEY_ID = "id"
@@ -48,7 +50,9 @@ def make_part_string(parts: List[str]) -> str:
 	return ','.join(parts)
 
 
-def dump_playlist(youtube_api, playlist: object, thumbs_dir_path: str, no_thumbs: bool, thumb_list: List[str]):
+def dump_playlist(youtube_api, playlist: object, thumbs_dir_path: str, no_thumbs: bool, thumb_list: Set[str]):
+	import requests
+
 	playlist_id = playlist[API_KEY_ID]
 	playlist_title = playlist[API_KEY_SNIPPET][API_KEY_TITLE]
 
@@ -123,7 +127,7 @@ def dump_playlist(youtube_api, playlist: object, thumbs_dir_path: str, no_thumbs
 					with open(os.path.join(thumbs_dir_path, best_thumb_filename), "wb") as f:
 						f.write(remote_file.content)
 
-					thumb_list.append(vid_id)
+					thumb_list.add(vid_id)
 					thumb_dlded_cnt += 1
 
 			videos_on_playlist_full.append(vid_data)
@@ -151,18 +155,80 @@ def dump_playlist(youtube_api, playlist: object, thumbs_dir_path: str, no_thumbs
 	return full_playlist, refs_playlist, thumb_dlded_cnt
 
 
-def build_yt_api_object():
-	flow = google_auth_oauthlib.flow.InstalledAppFlow.from_client_secrets_file(CLIENT_SECRETS_FILE, SCOPES)
-	credentials = flow.run_local_server()
-	return googleapiclient.discovery.build("youtube", "v3", credentials=credentials)
+def get_credentials(credentials_path: str):
+	"""
+	Loads cached OAuth credentials, refreshing them if they have expired. If there are no cached credentials or they
+	cannot be refreshed, runs the interactive OAuth flow. Credentials are saved back to the cache file, so that
+	subsequent runs (e.g. from cron) don't require user interaction.
+	"""
+	import google.auth.exceptions
+	import google.auth.transport.requests
+	import google.oauth2.credentials
+	import google_auth_oauthlib.flow
+
+	credentials = None
+	if os.path.exists(credentials_path):
+		try:
+			credentials = google.oauth2.credentials.Credentials.from_authorized_user_file(credentials_path, SCOPES)
+		except ValueError as ex:
+			print("Cannot load cached credentials:", ex)
+
+	if credentials is not None and not credentials.valid and credentials.expired and credentials.refresh_token:
+		print("Refreshing cached credentials")
+		try:
+			credentials.refresh(google.auth.transport.requests.Request())
+		except google.auth.exceptions.RefreshError as ex:
+			print("Cannot refresh cached credentials:", ex)
+			credentials = None
+
+	if credentials is None or not credentials.valid:
+		flow = google_auth_oauthlib.flow.InstalledAppFlow.from_client_secrets_file(CLIENT_SECRETS_FILE, SCOPES)
+		credentials = flow.run_local_server()
+
+	os.makedirs(os.path.dirname(credentials_path) or '.', exist_ok=True)
+	# credentials contain refresh token and client secret - make them readable only by the owner
+	fd = os.open(credentials_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+	os.chmod(credentials_path, 0o600) # in case the file already existed with wider permissions
+	with os.fdopen(fd, "w") as f:
+		f.write(credentials.to_json())
+
+	return credentials
+
+
+def get_discovery_document(discovery_path: str) -> object:
+	"""
+	Loads cached API discovery document. If it's not cached yet, downloads it and saves it to the cache file.
+	"""
+	discovery_doc = load_json(discovery_path)
+	if discovery_doc is not None:
+		return discovery_doc
 
+	import requests
 
-def dump_account_playlists(youtube_api, thumbs_dir_path: str, no_thumbs: bool, time_now: datetime):
-	thumb_list = get_thumb_list(thumbs_dir_path)
-	thumb_dlded_cnt = 0
+	print("Downloading API discovery document")
+	response = requests.get(DISCOVERY_URL)
+	response.raise_for_status()
+	discovery_doc = response.json()
 
-	dump_full = []
-	refs_playlists = []
+	os.makedirs(os.path.dirname(discovery_path) or '.', exist_ok=True)
+	save_json(discovery_doc, discovery_path)
+
+	return discovery_doc
+
+
+def build_yt_api_object(root_dir: str):
+	import googleapiclient.discovery
+
+	credentials = get_credentials(os.path.join(root_dir, FILENAME_CREDENTIALS))
+	discovery_doc = get_discovery_document(os.path.join(root_dir, FILENAME_DISCOVERY))
+	return googleapiclient.discovery.build_from_document(discovery_doc, credentials=credentials)
+
+
+def list_account_playlists(youtube_api) -> List[object]:
+	"""
+	Returns metadata of all playlists created by the logged in account.
+	"""
+	playlists_meta = []
 
 	next_page_token = None
 	page_number = 1
@@ -178,27 +244,14 @@ def dump_account_playlists(youtube_api, thumbs_dir_path: str, no_thumbs: bool, t
 		)
 		playlist_response = request.execute()
 
-		for playlist in playlist_response[API_KEY_ITEMS]:
-			full_playlist, refs_playlist, playlist_thumb_dlded_cnt = dump_playlist(youtube_api, playlist, thumbs_dir_path, no_thumbs, thumb_list)
-
-			thumb_dlded_cnt += playlist_thumb_dlded_cnt
-			dump_full.append(full_playlist)
-			refs_playlists.append(refs_playlist)
+		playlists_meta.extend(playlist_response[API_KEY_ITEMS])
 
 		if API_KEY_NEXT_PAGE_TOKEN not in playlist_response:
 			break
 
 		next_page_token = playlist_response[API_KEY_NEXT_PAGE_TOKEN]
 
-	dump_refs = {
-		JSON_KEY_DUMP_TIME: int(time_now.timestamp()),
-		JSON_KEY_PLAYLISTS: refs_playlists
-	}
-
-	if not no_thumbs:
-		print("Downloaded", thumb_dlded_cnt, "new thumbnails")
-
-	return dump_full, dump_refs
+	return playlists_meta
 
 
 def read_list_of_playlists_file(path: str) -> List[str]:
@@ -259,31 +312,46 @@ def dump_playlist_meta(youtube_api, playlist_ids: List[str]):
 	return playlists_meta
 
 
-def dump_list_of_playlists(youtube_api, thumbs_dir_path: str, no_thumbs: bool, time_now: datetime, list_path: str):
-	thumb_list = get_thumb_list(thumbs_dir_path)
+def dump_playlists(youtube_api, thumbs_dir_path: str, no_thumbs: bool, time_now: datetime, playlist_sets: Dict[str, List[object]], thumb_list: Set[str] = None):
+	"""
+	Dumps several named sets of playlists (e.g. account and saved) in a single pass. A playlist present in more than
+	one set is fetched only once, and thumbnails are listed only once.
+
+	@playlist_sets: dictionary mapping set name to a list of playlist metadata objects
+	@thumb_list: set of video ids that have a thumbnail downloaded, will be updated with new thumbnails.
+		If None, it will be read from thumbnails directory.
+
+	@returns: tuple(
+		full dump (list of playlists, each playlist appears only once),
+		dictionary mapping set name to refs dump of that set,
+	)
+	"""
+	if thumb_list is None:
+		thumb_list = get_thumb_list(thumbs_dir_path)
 	thumb_dlded_cnt = 0
 
 	dump_full = []
-	refs_playlists = []
+	refs_by_id = {}
 
-	playlist_ids = read_list_of_playlists_file(list_path)
-	if playlist_ids is None:
-		return None, None
+	for playlists_meta in playlist_sets.values():
+		for playlist in playlists_meta:
+			if playlist[API_KEY_ID] in refs_by_id:
+				continue
 
-	playlist_meta = dump_playlist_meta(youtube_api, playlist_ids)
-	for playlist in playlist_meta:
-		full_playlist, refs_playlist, playlist_thumb_dlded_cnt = dump_playlist(youtube_api, playlist, thumbs_dir_path, no_thumbs, thumb_list)
+			full_playlist, refs_playlist, playlist_thumb_dlded_cnt = dump_playlist(youtube_api, playlist, thumbs_dir_path, no_thumbs, thumb_list)
 
-		thumb_dlded_cnt += playlist_thumb_dlded_cnt
-		dump_full.append(full_playlist)
-		refs_playlists.append(refs_playlist)
+			thumb_dlded_cnt += playlist_thumb_dlded_cnt
+			dump_full.append(full_playlist)
+			refs_by_id[playlist[API_KEY_ID]] = refs_playlist
 
-	dump_refs = {
-		JSON_KEY_DUMP_TIME: int(time_now.timestamp()),
-		JSON_KEY_PLAYLISTS: refs_playlists
-	}
+	dumps_refs = {}
+	for set_name, playlists_meta in playlist_sets.items():
+		dumps_refs[set_name] = {
+			JSON_KEY_DUMP_TIME: int(time_now.timestamp()),
+			JSON_KEY_PLAYLISTS: [refs_by_id[playlist[API_KEY_ID]] for playlist in playlists_meta]
+		}
 
 	if not no_thumbs:
 		print("Downloaded", thumb_dlded_cnt, "new thumbnails")
 
-	return dump_full, dump_refs
+	return dump_full, dumps_refs
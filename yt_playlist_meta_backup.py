@@ -1,101 +1,19 @@
 import os
 import argparse
-import shutil
-from datetime import datetime
 
 from consts import *
-from json_util import load_json, save_json
+from archiver import run_dump
+from daemon import Daemon, send_control_command
+from export import EXPORT_FORMATS, EXPORT_FORMAT_NDJSON, EXPORT_FORMAT_PARQUET, export_archive, is_parquet_available
+from fsck import fsck
+from json_util import load_json
 from html_gen import generate_html
-from util import get_file_title_from_path, datetime_to_timestring, datetime_to_timestamp
-from yt_api import build_yt_api_object, dump_account_playlists, dump_list_of_playlists
-
-
-def get_local_db(db_path: str) -> object:
-	"""
-	If the database file does not exist, creates a database.
-	If the database file exists, loads it.
-	"""
-	db = load_json(db_path)
-	if db is None:
-		print("Cannot load local database, creating new one")
-		return DB_TEMPLATE
-
-	return db
-
-
-def save_local_db(db: object, db_path: str, backups_dir: str, no_backup: bool, datetime_now: datetime):
-	if not no_backup and os.path.exists(db_path):
-		db_name = get_file_title_from_path(db_path)
-		backup_filename = "%s_%s.json" % (db_name, datetime_to_timestring(datetime_now))
-		print("Backing up", db_name, "to", backup_filename)
-		os.makedirs(backups_dir, exist_ok=True)
-		backup_path = os.path.join(backups_dir, backup_filename)
-		shutil.move(db_path, backup_path)
-	save_json(db, db_path)
-
-
-def can_overwrite_snapshot(existing_snapshot: object, new_snapshot: object) -> bool:
-	"""
-	Checks if a snapshot metadata object can be overwritten with a new one. This can happen if the new one contains the
-	same keys with the same values. It can also contain additional, new keys.
-	Assumptions: both are dictionaries containing non-array and non-object values.
-	"""
-	for key, value in existing_snapshot.items():
-		if key not in new_snapshot:
-			return False
-		elif new_snapshot[key] != existing_snapshot[key]:
-			return False
-
-	return True
-
-
-def update_db(db: object, dump: object, timestamp_now: int) -> object:
-	for playlist in dump:
-		if JSON_KEY_VIDEOS not in playlist:
-			print("\"%s\" not found in playlist, skipping" % JSON_KEY_VIDEOS)
-			continue
-
-		for in_video in playlist[JSON_KEY_VIDEOS]:
-			if JSON_KEY_ID not in in_video:
-				print("\"%s\" not found in video, skipping" % JSON_KEY_ID)
-				continue
-
-			vid_id = in_video[JSON_KEY_ID]
-			del in_video[JSON_KEY_ID] # vid id is a key in db, it's not needed inside meta
-
-			if JSON_KEY_ADDED_TIME in in_video:
-				del in_video[JSON_KEY_ADDED_TIME] # added to playlist is stored in dumps, in playlists
-
-			if vid_id in db:
-				# at least one version of this video is already present in db
-				same_metadata_timestamp = None
-				insert_updated = True
-				for existing_video_timestamp, existing_video in db[vid_id].items():
-					if existing_video_timestamp == timestamp_now:
-						# we've already parsed this metadata in some other playlist during this run.
-						# it might happen that the metadata is actually different, but if it's from the same-ish time
-						# it doesn't really matter which one we take.
-						insert_updated = False
-						break
-
-					if can_overwrite_snapshot(existing_video, in_video):
-						same_metadata_timestamp = existing_video_timestamp
-						break
-
-				if insert_updated:
-					if same_metadata_timestamp is not None:
-						# one of the captures of metadata matches current capture - only bump its time
-						# (delete existing and add new with updated timestamp)
-						del db[vid_id][existing_video_timestamp]
-
-					# add the new metadata entry either way
-					db[vid_id][timestamp_now] = in_video
-			else:
-				# video is not found in db - add it with current time
-				db[vid_id] = {
-					timestamp_now: in_video
-				}
-	return db
+from local_db import get_local_db
+from server import serve_archive
+from similarity import report_similar_videos, report_duplicate_clusters
+from thumb_hash import is_hashing_available, report_thumb_duplicates
+from util import get_file_title_from_path
+from yt_api import build_yt_api_object
 
 
 if __name__ == "__main__":
@@ -107,6 +25,26 @@ if __name__ == "__main__":
 	parser.add_argument("--root", action="store", type=str, default=DEFAULT_ROOT, help=("Root data directory path"))
 	parser.add_argument("--nothumbs", action="store_true", help=("Don't download thumbnails"))
 	parser.add_argument("--nobackup", action="store_true", help=("Don't make a backup of local database before modification"))
+	parser.add_argument("--daemon", action="store_true", help=("Stay resident and dump selected playlist sets (-o and/or -p) on a schedule. Database is kept in memory between runs, so it should not be modified by other commands while the daemon is running."))
+	parser.add_argument("--oauth-interval", action="store", type=int, default=360, help=("Daemon mode: minutes between dumps of account playlists"))
+	parser.add_argument("--playlists-interval", action="store", type=int, default=360, help=("Daemon mode: minutes between dumps of saved playlists"))
+	parser.add_argument("--jitter", action="store", type=int, default=10, help=("Daemon mode: maximum random delay in minutes added to each interval"))
+	parser.add_argument("--daemon-html", action="store_true", help=("Daemon mode: generate HTML files for new dumps right after each run"))
+	parser.add_argument("--serve", action="store_true", help=("Instead of dumping playlists, run a local web server rendering pages of dumps, playlists and video snapshot history on request."))
+	parser.add_argument("--bind", action="store", type=str, default="127.0.0.1", help=("Server mode: address to listen on"))
+	parser.add_argument("--port", action="store", type=int, default=8000, help=("Server mode: port to listen on"))
+	parser.add_argument("--cache-size", action="store", type=int, default=128, help=("Server mode: maximum number of rendered pages kept in memory"))
+	parser.add_argument("--export", action="store", type=str, help=("Instead of dumping playlists, export database snapshots and dumps contents as flat rows to this directory"))
+	parser.add_argument("--export-format", action="store", type=str, choices=EXPORT_FORMATS, default=EXPORT_FORMAT_NDJSON, help=("Export mode: output format (" + EXPORT_FORMAT_PARQUET + " requires pyarrow)"))
+	parser.add_argument("--incremental", action="store_true", help=("Export mode: only export snapshots and dumps added since the last export to the same directory"))
+	parser.add_argument("--thumb-dups", action="store_true", help=("Instead of dumping playlists, update thumbnail hash index and list groups of videos with near-duplicate thumbnails (requires Pillow)"))
+	parser.add_argument("--thumb-distance", action="store", type=int, default=4, help=("Maximum number of differing bits (out of 64) of thumbnail hashes considered near-duplicates"))
+	parser.add_argument("--similar", action="store", type=str, help=("Instead of dumping playlists, list videos with metadata (title, description) similar to video with this ID, e.g. reuploads of a deleted video"))
+	parser.add_argument("--dup-report", action="store_true", help=("Instead of dumping playlists, list clusters of videos with similar metadata across the whole archive"))
+	parser.add_argument("--similarity", action="store", type=float, default=0.5, help=("Minimum estimated similarity (0-1) of video metadata for --similar and --dup-report"))
+	parser.add_argument("--fsck", action="store_true", help=("Instead of dumping playlists, check consistency of database, dumps and thumbnails"))
+	parser.add_argument("--repair", action="store_true", help=("Check mode: repair found problems. Database is backed up first, broken entries and orphaned files are moved to $ROOT_DIR/" + DIR_QUARANTINE))
+	parser.add_argument("--control", action="store", type=str, nargs="+", help=("Send a command to a running daemon and print its response. Commands:\n  status\n  run [" + DUMP_SET_ACCOUNT + "] [" + DUMP_SET_SAVED + "]"))
 	args = parser.parse_args()
 
 	if args.html is not None:
@@ -130,38 +68,88 @@ if __name__ == "__main__":
 		generate_html(db, dump, output_filename, thumbs_dir_path)
 
 		print("HTML generation finished")
+	elif args.serve:
+		if args.oauth or args.playlists:
+			print("--oauth and --playlists cannot be used alongside --serve")
+			exit(1)
+
+		serve_archive(args.root, args.bind, args.port, args.cache_size, args.thumb_distance)
+	elif args.export is not None:
+		if args.oauth or args.playlists:
+			print("--oauth and --playlists cannot be used alongside --export")
+			exit(1)
+
+		if args.export_format == EXPORT_FORMAT_PARQUET and not is_parquet_available():
+			print("pyarrow is required for %s export" % EXPORT_FORMAT_PARQUET)
+			exit(1)
+
+		export_archive(args.root, args.export, args.export_format, args.incremental)
+
+		print("Export finished")
+	elif args.thumb_dups:
+		if args.oauth or args.playlists:
+			print("--oauth and --playlists cannot be used alongside --thumb-dups")
+			exit(1)
+
+		if not is_hashing_available():
+			print("Pillow is required for thumbnail hashing")
+			exit(1)
+
+		report_thumb_duplicates(args.root, args.thumb_distance)
+	elif args.similar is not None or args.dup_report:
+		if args.oauth or args.playlists:
+			print("--oauth and --playlists cannot be used alongside --similar and --dup-report")
+			exit(1)
+
+		db = get_local_db(os.path.join(args.root, FILENAME_DB))
+
+		if args.similar is not None:
+			report_similar_videos(db, args.root, args.similar, args.similarity)
+		else:
+			report_duplicate_clusters(db, args.root, args.similarity)
+	elif args.fsck:
+		if args.oauth or args.playlists:
+			print("--oauth and --playlists cannot be used alongside --fsck")
+			exit(1)
+
+		if not fsck(args.root, args.repair):
+			exit(1)
+	elif args.control is not None:
+		try:
+			print(send_control_command(args.root, " ".join(args.control)))
+		except OSError as ex:
+			print("Cannot connect to daemon:", ex)
+			exit(1)
 	else:
-		print("Dump mode")
+		print("Daemon mode" if args.daemon else "Dump mode")
 
 		if not args.oauth and not args.playlists:
 			print("--oauth and/or --playlists must be selected in dump mode")
 			exit(1)
 
-		youtube_api = build_yt_api_object()
+		set_names = []
+		if args.oauth:
+			set_names.append(DUMP_SET_ACCOUNT)
+		if args.playlists:
+			set_names.append(DUMP_SET_SAVED)
 
-		db_path = os.path.join(args.root, FILENAME_DB)
-		backups_dir_path = os.path.join(args.root, DIR_BACKUPS)
-		thumbs_dir_path = os.path.join(args.root, DIR_THUMBS)
-		dumps_dir_path = os.path.join(args.root, DIR_DUMPS)
-		saved_playlists_path = os.path.join(args.root, FILENAME_SAVED_PLAYLISTS)
+		if args.daemon:
+			intervals = {}
+			if args.oauth:
+				intervals[DUMP_SET_ACCOUNT] = args.oauth_interval * 60
+			if args.playlists:
+				intervals[DUMP_SET_SAVED] = args.playlists_interval * 60
 
-		db = get_local_db(db_path)
+			daemon = Daemon(args.root, intervals, args.jitter * 60, args.nothumbs, args.nobackup, args.daemon_html)
+			daemon.run_forever()
+			exit(0)
 
-		time_now = datetime.now()
+		youtube_api = build_yt_api_object(args.root)
 
-		if args.oauth:
-			full_dump_oauth, refs_dump_oauth = dump_account_playlists(youtube_api, thumbs_dir_path, args.nothumbs, time_now)
-			save_json(refs_dump_oauth, os.path.join(dumps_dir_path, "dump_%s_account.json" % datetime_to_timestring(time_now)))
-			db = update_db(db, full_dump_oauth, datetime_to_timestamp(time_now))
-			save_local_db(db, db_path, backups_dir_path, args.nobackup, time_now)
+		db = get_local_db(os.path.join(args.root, FILENAME_DB))
 
-		if args.playlists:
-			full_dump_oauth, refs_dump_oauth = dump_list_of_playlists(youtube_api, thumbs_dir_path, args.nothumbs, time_now, saved_playlists_path)
-			if full_dump_oauth is None or refs_dump_oauth is None:
-				print("Dump aborted")
-				exit(1)
-			save_json(refs_dump_oauth, os.path.join(dumps_dir_path, "dump_%s_saved.json" % datetime_to_timestring(time_now)))
-			db = update_db(db, full_dump_oauth, datetime_to_timestamp(time_now))
-			save_local_db(db, db_path, backups_dir_path, args.nobackup, time_now)
+		if run_dump(youtube_api, db, args.root, set_names, args.nothumbs, args.nobackup) is None:
+			print("Dump aborted")
+			exit(1)
 
 		print("Dump finished")